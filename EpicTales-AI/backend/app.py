@@ -1,39 +1,47 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
+from werkzeug.security import safe_join
 import os
 import logging
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import base64
 import io
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import json
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+import heapq
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import hashlib
+import re
+import sqlite3
+import uuid
+import zipfile
+import zlib
 from dotenv import load_dotenv
 import gc
 import psutil
 import sys
 from werkzeug.middleware.profiler import ProfilerMiddleware
 
-# PDF generation imports
-try:
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, PageBreak
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.lib import colors
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.utils import ImageReader
-    HAS_REPORTLAB = True
-except ImportError:
-    HAS_REPORTLAB = False
-    print("ReportLab not available - PDF functionality disabled")
-
 # Load environment variables
 load_dotenv()
 
+# Rendering lives in slim modules so render processes don't import the web app
+from caches import LRUCache
+from render_worker import (
+    HAS_REPORTLAB, PDF_IMAGE_DPI, PDF_JPEG_QUALITY,
+    save_image_atomic, render_fallback_image, get_file_hash, render_storybook_pdf
+)
+if not HAS_REPORTLAB:
+    print("ReportLab not available - PDF functionality disabled")
+
 app = Flask(__name__)
 
 # Memory management configuration
@@ -99,10 +107,612 @@ try:
 except Exception:
     HAS_CLIENT = False
 
-# Global cache with memory limits
-story_cache = {}
-image_cache = {}
-cache_max_size = 100  # Maximum cache entries
+# HEDGED MODEL FALLBACK CONFIG
+IMAGE_HEDGING = os.getenv('IMAGE_HEDGING', 'true').lower() == 'true'
+HEDGE_DELAY = float(os.getenv('HEDGE_DELAY_SECONDS', '8'))  # Start a second model after this long
+HEDGE_MAX_PARALLEL = int(os.getenv('HEDGE_MAX_PARALLEL', '2'))  # Racing attempts per scene
+
+# MODEL CIRCUIT BREAKER CONFIG
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '3'))  # Consecutive failures to trip
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN_SECONDS', '60'))  # Open time before a probe
+
+# UPSTREAM CONNECTION POOL CONFIG
+HF_API_BASE = "https://api-inference.huggingface.co"
+# One keep-alive connection per in-flight scene: MAX_WORKERS scenes x concurrent stories
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', str(MAX_WORKERS * 4)))
+UPSTREAM_MAX_INFLIGHT = int(os.getenv('UPSTREAM_MAX_INFLIGHT', str(UPSTREAM_POOL_SIZE)))
+
+# SHARED IMAGE POOL CONFIG (backpressure instead of unbounded threads)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(MAX_WORKERS * 2)))  # Scenes rendered at once per worker
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', str(MAX_WORKERS * 8)))  # Scenes allowed to wait
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '5'))
+
+# RENDER PROCESS POOL CONFIG (PDF and fallback images run off the GIL)
+WEB_WORKERS = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))  # Gunicorn workers sharing this machine
+RENDER_PROCESSES = int(os.getenv('RENDER_PROCESSES', str(max(1, (os.cpu_count() or 2) // WEB_WORKERS))))  # Per gunicorn worker, 0 renders inline
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', str(max(RENDER_PROCESSES, 1) * 4)))
+RENDER_TIMEOUT = int(os.getenv('RENDER_TIMEOUT_SECONDS', '60'))
+BATCH_EXPORT_MAX_BOOKS = int(os.getenv('BATCH_EXPORT_MAX_BOOKS', '50'))
+UPSTREAM_WARMUP_CONNECTIONS = int(os.getenv('UPSTREAM_WARMUP_CONNECTIONS', '0'))
+
+upstream_stats = {"requests": 0, "connections_opened": 0, "warmup_requests": 0}
+upstream_stats_lock = threading.Lock()
+
+def record_upstream(counter):
+    with upstream_stats_lock:
+        upstream_stats[counter] += 1
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    """Counts new TCP connections so reuse can be measured"""
+    def _new_conn(self):
+        record_upstream("connections_opened")
+        return super()._new_conn()
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """Counts new TCP+TLS connections so reuse can be measured"""
+    def _new_conn(self):
+        record_upstream("connections_opened")
+        return super()._new_conn()
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """Keep-alive adapter that reports requests and connection opens"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+
+    def send(self, request, **kwargs):
+        record_upstream("requests")
+        return super().send(request, **kwargs)
+
+# Per-worker upstream clients - sockets must never be shared across fork
+upstream_session = None
+inference_client = None
+upstream_pid = None
+upstream_lock = threading.RLock()
+
+def build_upstream_session():
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def ensure_upstream_clients():
+    """Create the pooled session and InferenceClient once per worker process"""
+    global upstream_session, inference_client, upstream_pid
+    with upstream_lock:
+        if upstream_pid != os.getpid():
+            upstream_session = build_upstream_session()
+            inference_client = InferenceClient(token=TOKEN) if HAS_CLIENT else None
+            upstream_pid = os.getpid()
+
+def get_upstream_session():
+    ensure_upstream_clients()
+    return upstream_session
+
+def get_inference_client():
+    ensure_upstream_clients()
+    return inference_client
+
+# Route huggingface_hub's own HTTP calls through the pooled session too
+if HAS_CLIENT:
+    try:
+        from huggingface_hub import configure_http_backend
+        configure_http_backend(backend_factory=get_upstream_session)
+    except ImportError:
+        logger.warning("⚠️ huggingface_hub too old for configure_http_backend - InferenceClient uses its own session")
+
+def warm_upstream_pool(connections=UPSTREAM_WARMUP_CONNECTIONS):
+    """Open keep-alive connections to the inference API before the first request needs them"""
+    if connections <= 0:
+        return
+    session = get_upstream_session()
+    
+    def touch():
+        try:
+            record_upstream("warmup_requests")
+            session.head(HF_API_BASE, timeout=HTTP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"⚠️ Upstream warm-up failed: {e}")
+    
+    # Concurrent requests so each one opens its own connection
+    threads = [threading.Thread(target=touch, daemon=True) for _ in range(min(connections, UPSTREAM_POOL_SIZE))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.info(f"🔌 Warmed {len(threads)} upstream connections (pid: {os.getpid()})")
+
+def init_worker():
+    """Per-worker setup, called from gunicorn's post_worker_init hook"""
+    ensure_upstream_clients()
+    if UPSTREAM_WARMUP_CONNECTIONS > 0:
+        threading.Thread(target=warm_upstream_pool, daemon=True).start()
+
+def get_upstream_stats():
+    with upstream_stats_lock:
+        stats = dict(upstream_stats)
+    reused = max(0, stats["requests"] - stats["connections_opened"])
+    stats["connections_reused"] = reused
+    stats["reuse_rate"] = round(reused / stats["requests"], 3) if stats["requests"] else 0.0
+    stats["pool_size"] = UPSTREAM_POOL_SIZE
+    return stats
+
+# Optional Redis backend for the shared cache
+try:
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+# SHARED CACHE CONFIG - one store for every gunicorn worker, survives restarts
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite').lower()  # sqlite | redis
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join('cache', 'epictales_cache.db'))
+CACHE_TTL = int(os.getenv('CACHE_TTL', '86400'))  # 24 hours
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+class SQLiteCache:
+    """JSON key/value store on disk shared by all worker processes on the host"""
+
+    def __init__(self, path, default_ttl=CACHE_TTL):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        """One connection per thread, reopened after fork so workers never share a handle"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at)
+        )
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        cursor = self._conn().execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+class RedisCache:
+    """Same interface as SQLiteCache, backed by any Redis-compatible server"""
+
+    def __init__(self, url, default_ttl=CACHE_TTL, prefix="epictales:"):
+        self.url = url
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+        self._client = None
+        self._pid = None
+
+    def _redis(self):
+        # redis-py pools are not fork-safe, so build the client inside each worker
+        if self._client is None or self._pid != os.getpid():
+            self._client = redis.Redis.from_url(self.url, socket_timeout=2)
+            self._pid = os.getpid()
+        return self._client
+
+    def get(self, key):
+        value = self._redis().get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self._redis().set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self._redis().delete(self.prefix + key)
+
+    def purge_expired(self):
+        return 0  # Redis expires keys on its own
+
+    def __len__(self):
+        return sum(1 for _ in self._redis().scan_iter(match=self.prefix + "*"))
+
+class SharedCache:
+    """Error-tolerant wrapper - a broken cache must never fail a request"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = type(backend).__name__
+
+    def get(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set(key, value, ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {key}: {e}")
+
+    def delete(self, key):
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.warning(f"Shared cache delete failed for {key}: {e}")
+
+    def purge_expired(self):
+        try:
+            return self.backend.purge_expired()
+        except Exception as e:
+            logger.warning(f"Shared cache purge failed: {e}")
+            return 0
+
+    def __len__(self):
+        try:
+            return len(self.backend)
+        except Exception:
+            return 0
+
+def create_shared_cache():
+    """Build the configured shared cache backend"""
+    if CACHE_BACKEND == 'redis':
+        if HAS_REDIS:
+            logger.info(f"💾 Shared cache: Redis at {REDIS_URL}")
+            return SharedCache(RedisCache(REDIS_URL))
+        logger.warning("⚠️ CACHE_BACKEND=redis but redis package missing - using SQLite")
+    logger.info(f"💾 Shared cache: SQLite at {CACHE_DB_PATH}")
+    return SharedCache(SQLiteCache(CACHE_DB_PATH))
+
+shared_cache = create_shared_cache()
+
+# PER-PROCESS CACHE CONFIG - byte budgets rather than entry counts
+STORY_CACHE_MAX_BYTES = int(os.getenv('STORY_CACHE_MAX_MB', '16')) * 1024 * 1024
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_MB', '2')) * 1024 * 1024
+IMAGE_CACHE_TTL = 3600  # Generated files are cleaned up after ~1 hour
+
+# Global caches with memory limits (per-process front of shared_cache)
+story_cache = LRUCache(STORY_CACHE_MAX_BYTES, default_ttl=CACHE_TTL)
+image_cache = LRUCache(IMAGE_CACHE_MAX_BYTES, default_ttl=IMAGE_CACHE_TTL)
+
+class ForkSafeExecutor:
+    """ThreadPoolExecutor built lazily in each process - threads do not survive fork"""
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self.get().submit(fn, *args, **kwargs)
+
+class PoolBusyError(Exception):
+    """Raised when a bounded pool has no room for more work"""
+
+# Task priorities for BoundedExecutor - lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_BATCH = 2
+
+class BoundedExecutor:
+    """Long-lived worker pool with a bounded, prioritized queue - rejects work instead of piling it up
+
+    Waiting tasks sit in a heap ordered by (priority, submission order).
+    Every submission hands the thread pool one "run the best waiting task"
+    call, so a free thread always picks up the most urgent work.
+    """
+
+    def __init__(self, max_workers, max_queue, thread_name_prefix):
+        self.name = thread_name_prefix
+        self.capacity = max_workers + max_queue  # Running plus waiting tasks
+        self._executor = ForkSafeExecutor(max_workers, thread_name_prefix)
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)  # Signalled whenever a task finishes
+        self._waiting = []  # heap of (priority, seq, future, fn, args)
+        self._seq = itertools.count()
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+            self._room.notify_all()
+
+    def _run_next(self):
+        while True:
+            with self._lock:
+                if not self._waiting:
+                    return
+                _, _, future, fn, args = heapq.heappop(self._waiting)
+            if not future.set_running_or_notify_cancel():
+                continue  # Cancelled while waiting - take the next one
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            return
+
+    def submit_all(self, calls, timeout=None, priority=PRIORITY_INTERACTIVE):
+        """Submit [(fn, args), ...] all-or-nothing, returns the futures
+
+        Without a timeout this never waits: if there is no room for every
+        call, PoolBusyError is raised and nothing is queued. With a timeout
+        the caller waits for room for all calls at once - it never holds
+        part of the capacity while waiting for the rest.
+        """
+        deadline = time.time() + timeout if timeout else None
+        futures = []
+        with self._lock:
+            while self.pending + len(calls) > self.capacity:
+                remaining = deadline - time.time() if deadline else 0
+                if remaining <= 0 or len(calls) > self.capacity:
+                    self.rejected += 1
+                    raise PoolBusyError(f"{self.name} pool is full ({self.capacity} tasks), try again shortly")
+                self._room.wait(remaining)
+            self.pending += len(calls)
+            self.submitted += len(calls)
+            for fn, args in calls:
+                future = Future()
+                future.add_done_callback(self._release)
+                heapq.heappush(self._waiting, (priority, next(self._seq), future, fn, args))
+                futures.append(future)
+        for _ in calls:
+            self._executor.submit(self._run_next)
+        return futures
+
+    def submit(self, fn, *args, timeout=None, priority=PRIORITY_INTERACTIVE):
+        return self.submit_all([(fn, args)], timeout=timeout, priority=priority)[0]
+
+    def wait_for_room(self, count, timeout):
+        """Block until count more tasks would fit, returns False on timeout"""
+        count = min(count, self.capacity)
+        with self._lock:
+            return self._room.wait_for(lambda: self.pending + count <= self.capacity, max(0, timeout))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self._executor.max_workers,
+                "capacity": self.capacity,
+                "pending": self.pending,
+                "waiting": len(self._waiting),
+                "submitted": self.submitted,
+                "rejected": self.rejected
+            }
+
+class RenderPool:
+    """Process pool for CPU-bound rendering with a bounded queue
+
+    Children are started with spawn, so they import this module fresh
+    instead of inheriting locks and threads from a forked gunicorn worker.
+    Processes start lazily on first use. A job that times out keeps its
+    slot until the child actually finishes, so a stuck render can never
+    push the pool past its capacity.
+    """
+
+    def __init__(self, processes, max_queue, timeout):
+        self.processes = processes
+        self.capacity = processes + max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(self.capacity, 1))
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.inline = 0
+
+    def _get(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self, executor):
+        """Drop a broken pool so the next job starts fresh processes"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def run(self, fn, *args, timeout=None):
+        """Run fn(*args) in a render process and return its result
+
+        fn must be a module-level function and args must pickle. Raises
+        PoolBusyError when the queue is full and TimeoutError after
+        timeout seconds (RENDER_TIMEOUT by default).
+        """
+        if self.processes <= 0:
+            with self._lock:
+                self.inline += 1
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusyError(f"render pool is full ({self.capacity} jobs), try again shortly")
+        
+        executor = self._get()
+        try:
+            future = executor.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self._slots.release()
+            self._reset(executor)
+            raise
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._release)
+        
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f"render job timed out after {timeout or self.timeout}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "capacity": self.capacity,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "inline": self.inline
+            }
+
+render_pool = RenderPool(RENDER_PROCESSES, RENDER_QUEUE_SIZE, RENDER_TIMEOUT)
+
+class SingleFlight:
+    """Coalesces identical in-flight work onto one shared future
+
+    The first caller for a key leads and gets a fresh proxy future;
+    concurrent callers with the same key get that same future instead of
+    starting the work again. Work attached to a key is cancelled only when
+    every holder has released it.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> {"future", "holders", "task"}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def join_or_lead(self, key):
+        """Returns (future, is_leader) - the leader must attach() or fail() the future"""
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                entry["holders"] += 1
+                self.followers += 1
+                return entry["future"], False
+            future = Future()
+            self._inflight[key] = {"future": future, "holders": 1, "task": None}
+            self.leaders += 1
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future, True
+
+    def attach(self, key, future, task):
+        """Resolve the shared future from the leader's real task"""
+        def copy_outcome(done):
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None and entry["future"] is future:
+                entry["task"] = task
+        task.add_done_callback(copy_outcome)
+
+    def fail(self, future, error):
+        future.set_exception(error)
+
+    def release(self, key, future):
+        """Drop one holder; cancel the work once nobody is waiting for it"""
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is None or entry["future"] is not future:
+                return  # Already finished
+            entry["holders"] -= 1
+            if entry["holders"] > 0 or entry["task"] is None:
+                return
+            # Detach first so a caller arriving now leads fresh work
+            # instead of joining a future that is about to be cancelled
+            del self._inflight[key]
+            task = entry["task"]
+        task.cancel()  # Outside the lock - its callbacks call back into _forget
+
+    def _forget(self, key, future):
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None and entry["future"] is future:
+                del self._inflight[key]
+
+    def do(self, key, fn, *args):
+        """Run fn once for all concurrent callers with the same key"""
+        future, leader = self.join_or_lead(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._inflight), "leaders": self.leaders, "followers": self.followers}
 
 # Memory management utilities
 def get_memory_usage():
@@ -133,26 +743,75 @@ def cleanup_old_files():
                     logger.error(f"Error cleaning file {filename}: {e}")
 
 def manage_cache_size():
-    """Limit cache size to prevent memory bloat"""
-    global story_cache, image_cache
-    
-    if len(story_cache) > cache_max_size:
-        # Remove oldest entries
-        keys_to_remove = list(story_cache.keys())[:-cache_max_size//2]
-        for key in keys_to_remove:
-            del story_cache[key]
-    
-    if len(image_cache) > cache_max_size:
-        keys_to_remove = list(image_cache.keys())[:-cache_max_size//2]
-        for key in keys_to_remove:
-            del image_cache[key]
+    """Drop expired cache entries (LRU eviction keeps both caches within budget)"""
+    expired = story_cache.expire() + image_cache.expire()
+    if expired:
+        logger.info(f"🧹 Expired {expired} cache entries")
 
 # Periodic cleanup task
+# IMAGE DERIVATIVE CONFIG - resized/re-encoded variants served from /static
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+DERIVATIVE_DIR = os.path.join('cache', 'derived')
+DERIVATIVE_WIDTHS = (128, 256, 384, 512, 768, 1024)  # Requested widths snap up to these
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv('DERIVATIVE_CACHE_MAX_MB', '256')) * 1024 * 1024
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+    "png": ("PNG", "image/png", {"optimize": True})
+}
+os.makedirs(DERIVATIVE_DIR, exist_ok=True)
+
+# PDF CACHE CONFIG - rendered storybooks keyed by content hash
+PDF_CACHE_DIR = os.path.join('cache', 'pdf')
+PDF_CACHE_MAX_BYTES = int(os.getenv('PDF_CACHE_MAX_MB', '128')) * 1024 * 1024
+os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+
+def trim_file_cache(directory, max_bytes, label):
+    """Evict least recently used files until the directory is under budget"""
+    try:
+        entries = []
+        total = 0
+        for filename in os.listdir(directory):
+            if filename.endswith(".tmp"):
+                continue  # Write in progress
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= max_bytes:
+            return 0
+        
+        removed = 0
+        target = max_bytes * 0.9  # Leave headroom so we don't trim on every write
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        logger.info(f"🧹 Trimmed {removed} {label}")
+        return removed
+    except Exception as e:
+        logger.error(f"Cache trim error ({label}): {e}")
+        return 0
+
+def trim_derivative_cache(max_bytes=DERIVATIVE_CACHE_MAX_BYTES):
+    return trim_file_cache(DERIVATIVE_DIR, max_bytes, "image derivatives")
+
+def trim_pdf_cache(max_bytes=PDF_CACHE_MAX_BYTES):
+    return trim_file_cache(PDF_CACHE_DIR, max_bytes, "cached PDFs")
+
 def periodic_cleanup():
     """Run periodic cleanup tasks"""
     cleanup_memory()
     cleanup_old_files()
     manage_cache_size()
+    shared_cache.purge_expired()
+    trim_derivative_cache()
+    trim_pdf_cache()
     
     # Log memory usage
     memory_mb = get_memory_usage()
@@ -167,8 +826,10 @@ def schedule_cleanup():
     cleanup_timer.start()
     periodic_cleanup()
 
-# Start cleanup scheduler
-schedule_cleanup()
+# Start cleanup scheduler (not in spawned children - under `python app.py` they
+# re-run this file as their main module before loading render_worker)
+if multiprocessing.parent_process() is None:
+    schedule_cleanup()
 
 # Pre-built story templates for INSTANT generation (keeping this optimization)
 STORY_TEMPLATES = {
@@ -262,108 +923,138 @@ STORY_TEMPLATES = {
     }
 }
 
+STORY_TEMPLATE_VERSION = 2  # Part of the story cache key - bump when rendering changes
+
+# Words in STORY_TEMPLATES that are filled in per story
+TEMPLATE_SLOT_PATTERN = re.compile(r"(hero|Alex|Maya|Sam|adventure|\.)")
+PRESCHOOL_WORDS = {"dangerous": "challenging", "evil": "not-so-nice", "battle": "face-off"}
+PRESCHOOL_PATTERN = re.compile("|".join(PRESCHOOL_WORDS))
+
+# Tone-specific language
+TONE_MODIFIERS = {
+    "lighthearted": {"mood": "cheerful and fun", "approach": "with a smile"},
+    "adventurous": {"mood": "exciting and bold", "approach": "with courage"},
+    "magical": {"mood": "mystical and enchanting", "approach": "with wonder"},
+    "educational": {"mood": "informative and engaging", "approach": "with learning"}
+}
+
+class CompiledTemplate:
+    """Story template pre-split into literal text and named slots
+
+    Rendering fills every slot in one join, and inserted values are never
+    scanned again (so a character called "Samantha" stays "Samantha").
+    """
+
+    def __init__(self, text):
+        self.pieces = TEMPLATE_SLOT_PATTERN.split(text)  # literal, slot, literal, ...
+        self.slot_indexes = range(1, len(self.pieces), 2)
+
+    def render(self, values):
+        out = self.pieces[:]
+        for i in self.slot_indexes:
+            out[i] = values[out[i]]
+        return "".join(out)
+
+COMPILED_STORY_TEMPLATES = {
+    genre: {scene: [CompiledTemplate(text) for text in texts] for scene, texts in scenes.items()}
+    for genre, scenes in STORY_TEMPLATES.items()
+}
+
+def select_template(templates, story_idea, scene):
+    """Stable template choice - the same idea gets the same story in every worker"""
+    return templates[zlib.crc32(f"{story_idea}{scene}".encode()) % len(templates)]
+
+def soften_for_preschool(text):
+    return PRESCHOOL_PATTERN.sub(lambda m: PRESCHOOL_WORDS[m.group(0)], text)
+
 def get_story_hash(story_idea, genre, tone, audience, characters):
     """Create hash for caching"""
     character_names = ",".join(sorted(characters)) if characters else ""
-    content = f"{story_idea}_{genre}_{tone}_{audience}_{character_names}"
+    content = f"{STORY_TEMPLATE_VERSION}_{story_idea}_{genre}_{tone}_{audience}_{character_names}"
     return hashlib.md5(content.encode()).hexdigest()[:12]
 
+def build_story(story_idea, genre, tone, audience, characters):
+    """Fill the compiled templates for one set of story options"""
+    templates = COMPILED_STORY_TEMPLATES.get(genre, COMPILED_STORY_TEMPLATES["fantasy"])
+    
+    # Prepare character information
+    character_list = characters if characters else ["brave hero"]
+    main_character = character_list[0]
+    supporting_chars = character_list[1:]
+    
+    tone_style = TONE_MODIFIERS.get(tone, TONE_MODIFIERS["lighthearted"])
+    idea_lower = story_idea.lower()
+    
+    # Slot values shared by every scene
+    values = {"hero": main_character, "Alex": main_character, "Maya": main_character,
+              "Sam": main_character, ".": ".", "adventure": "adventure"}
+    intro_values = values
+    if supporting_chars:
+        char_intro = f", accompanied by {', '.join(supporting_chars[:-1])}" + (f" and {supporting_chars[-1]}" if len(supporting_chars) > 1 else f" and {supporting_chars[0]}")
+        intro_values = dict(values, **{".": char_intro + "."})
+    
+    story = {}
+    for scene in ["Introduction", "Rising Action", "Climax", "Resolution"]:
+        template = select_template(templates[scene], story_idea, scene)
+        scene_values = intro_values if scene == "Introduction" else values
+        personalized_story = template.render(scene_values)
+        
+        if scene == "Rising Action" and supporting_chars:
+            personalized_story += f" With help from {supporting_chars[0]}, they faced the challenge together."
+        
+        # Incorporate the specific story idea
+        if idea_lower not in personalized_story.lower():
+            if scene == "Introduction":
+                personalized_story = template.render(dict(scene_values, adventure=f"{story_idea} adventure"))
+            elif scene == "Rising Action":
+                personalized_story += f" The {story_idea} story becomes more intense."
+            elif scene == "Climax":
+                personalized_story += f" The heart of the {story_idea} tale reaches its peak."
+            else:  # Resolution
+                personalized_story += f" The {story_idea} adventure concludes beautifully."
+        
+        # Apply tone and audience modifications
+        if audience == "preschool":
+            personalized_story = soften_for_preschool(personalized_story)
+        
+        # Add tone-specific elements
+        if tone == "magical":
+            personalized_story += f" Sparkles of magic fill the air {tone_style['approach']}."
+        elif tone == "educational":
+            if scene == "Resolution":
+                personalized_story += f" And everyone learned something new {tone_style['approach']}."
+        elif tone == "adventurous":
+            personalized_story += f" The adventure continues {tone_style['approach']}."
+        
+        story[scene] = personalized_story
+    
+    # Add title based on user choices
+    title_parts = [story_idea.title()]
+    if len(character_list) > 1:
+        title_parts.append(f"and the {character_list[1].title()}")
+    story["title"] = " ".join(title_parts)
+    return story
+
 def generate_lightning_story(story_idea, genre, tone, audience, characters, art_style):
     """Enhanced story generation using all user options"""
     try:
         # Check cache first
         cache_key = get_story_hash(story_idea, genre, tone, audience, characters)
-        if cache_key in story_cache:
-            return story_cache[cache_key]
+        cached_story = story_cache.get(cache_key)
+        if cached_story is not None:
+            return cached_story
         
-        # Get templates for genre
-        templates = STORY_TEMPLATES.get(genre, STORY_TEMPLATES["fantasy"])
-        
-        # Prepare character information
-        character_list = characters if characters else ["brave hero"]
-        main_character = character_list[0] if character_list else "brave hero"
-        supporting_chars = character_list[1:] if len(character_list) > 1 else []
-        
-        # Create dynamic story based on all options
-        story = {}
-        
-        # Age-appropriate language based on audience
-        age_modifiers = {
-            "preschool": {"complexity": "simple", "words": "easy", "sentence_length": "short"},
-            "elementary": {"complexity": "moderate", "words": "clear", "sentence_length": "medium"},
-            "middle": {"complexity": "detailed", "words": "rich", "sentence_length": "varied"},
-            "all": {"complexity": "engaging", "words": "accessible", "sentence_length": "balanced"}
-        }
-        
-        age_style = age_modifiers.get(audience, age_modifiers["all"])
-        
-        # Tone-specific language
-        tone_modifiers = {
-            "lighthearted": {"mood": "cheerful and fun", "approach": "with a smile"},
-            "adventurous": {"mood": "exciting and bold", "approach": "with courage"},
-            "magical": {"mood": "mystical and enchanting", "approach": "with wonder"},
-            "educational": {"mood": "informative and engaging", "approach": "with learning"}
-        }
-        
-        tone_style = tone_modifiers.get(tone, tone_modifiers["lighthearted"])
-        
-        # Generate personalized story for each scene
-        for scene in ["Introduction", "Rising Action", "Climax", "Resolution"]:
-            base_template = templates[scene][hash(story_idea + scene) % len(templates[scene])]
-            
-            # Customize the story with user choices
-            personalized_story = base_template
-            
-            # Replace generic character names with selected characters
-            personalized_story = personalized_story.replace("hero", main_character)
-            personalized_story = personalized_story.replace("Alex", main_character)
-            personalized_story = personalized_story.replace("Maya", main_character)
-            personalized_story = personalized_story.replace("Sam", main_character)
-            
-            # Add supporting characters if available
-            if supporting_chars:
-                if scene == "Introduction":
-                    char_intro = f", accompanied by {', '.join(supporting_chars[:-1])}" + (f" and {supporting_chars[-1]}" if len(supporting_chars) > 1 else f" and {supporting_chars[0]}")
-                    personalized_story = personalized_story.replace(".", char_intro + ".")
-                elif scene == "Rising Action" and len(supporting_chars) > 0:
-                    personalized_story += f" With help from {supporting_chars[0]}, they faced the challenge together."
-            
-            # Incorporate the specific story idea
-            if story_idea.lower() not in personalized_story.lower():
-                if scene == "Introduction":
-                    personalized_story = personalized_story.replace("adventure", f"{story_idea} adventure")
-                elif scene == "Rising Action":
-                    personalized_story += f" The {story_idea} story becomes more intense."
-                elif scene == "Climax":
-                    personalized_story += f" The heart of the {story_idea} tale reaches its peak."
-                else:  # Resolution
-                    personalized_story += f" The {story_idea} adventure concludes beautifully."
-            
-            # Apply tone and audience modifications
-            if audience == "preschool":
-                personalized_story = personalized_story.replace("dangerous", "challenging")
-                personalized_story = personalized_story.replace("evil", "not-so-nice")
-                personalized_story = personalized_story.replace("battle", "face-off")
-            
-            # Add tone-specific elements
-            if tone == "magical":
-                personalized_story += f" Sparkles of magic fill the air {tone_style['approach']}."
-            elif tone == "educational":
-                if scene == "Resolution":
-                    personalized_story += f" And everyone learned something new {tone_style['approach']}."
-            elif tone == "adventurous":
-                personalized_story += f" The adventure continues {tone_style['approach']}."
-            
-            story[scene] = personalized_story
+        # Another worker (or a previous run) may already have built it
+        shared_story = shared_cache.get(f"story:{cache_key}")
+        if shared_story:
+            story_cache.set(cache_key, shared_story)
+            return shared_story
         
-        # Add title based on user choices
-        title_parts = [story_idea.title()]
-        if len(character_list) > 1:
-            title_parts.append(f"and the {character_list[1].title()}")
-        story["title"] = " ".join(title_parts)
+        story = build_story(story_idea, genre, tone, audience, characters)
         
         # Cache the result
-        story_cache[cache_key] = story
+        story_cache.set(cache_key, story)
+        shared_cache.set(f"story:{cache_key}", story)
         return story
         
     except Exception as e:
@@ -382,26 +1073,268 @@ def sanitize_filename(model_id):
     """Helper for filename from original working code"""
     return model_id.replace("/", "_").replace(" ", "_")
 
-def try_with_inference_client(prompt, model, scene_name):
+class ImageStore:
+    """Content-addressed index of generated images in static/
+
+    Files are named after a hash of (full_prompt, model, art_style), so the
+    same request always maps to the same file and the index can be rebuilt
+    from the directory listing alone.
+    """
+
+    FILENAME_PATTERN = re.compile(r"^hf_([0-9a-f]{32})\.(png|jpg|webp)$")
+    EXTENSIONS = ("png", "jpg", "webp")  # Upstream bytes are stored as delivered
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._index = {}  # digest -> filename
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuild()
+
+    @staticmethod
+    def key(full_prompt, model, art_style):
+        content = f"{full_prompt}\x1f{model}\x1f{art_style}"
+        return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def filename_for(digest, ext="png"):
+        return f"hf_{digest}.{ext}"
+
+    def rebuild(self):
+        """Rebuild the index from the files already in the directory"""
+        index = {}
+        for filename in os.listdir(self.directory):
+            match = self.FILENAME_PATTERN.match(filename)
+            if match:
+                index[match.group(1)] = filename
+        with self._lock:
+            self._index = index
+        logger.info(f"🗂️ Image store indexed {len(index)} existing images")
+
+    def lookup(self, digest):
+        """Return the stored filename for a digest, or None"""
+        with self._lock:
+            filename = self._index.get(digest)
+        # Another worker may have written it since our index was built
+        candidates = [filename] if filename else [self.filename_for(digest, ext) for ext in self.EXTENSIONS]
+        for candidate in candidates:
+            if os.path.exists(os.path.join(self.directory, candidate)):
+                with self._lock:
+                    self._index[digest] = candidate
+                    self.hits += 1
+                return candidate
+        with self._lock:
+            self._index.pop(digest, None)
+            self.misses += 1
+        return None
+
+    def add(self, digest, filename):
+        with self._lock:
+            self._index[digest] = filename
+
+    def stats(self):
+        with self._lock:
+            return {"indexed": len(self._index), "hits": self.hits, "misses": self.misses}
+
+image_store = ImageStore("static")
+
+class ModelHealth:
+    """Scoreboard and circuit breaker for every (model, transport) pair
+
+    Closed circuits are tried in order of expected time per success. After
+    BREAKER_FAILURE_THRESHOLD consecutive failures a circuit opens and is
+    skipped; once BREAKER_COOLDOWN has passed a single probe is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold, cooldown, default_latency):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.default_latency = default_latency
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {
+                "successes": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "latency_ewma": None,
+                "state": "closed",
+                "opened_at": None,
+                "probe_in_flight": False
+            }
+            self._entries[key] = entry
+        return entry
+
+    def _expected_cost(self, entry):
+        # Laplace-smoothed success rate so untried pairs sit between good and bad ones
+        success_rate = (entry["successes"] + 1) / (entry["successes"] + entry["failures"] + 2)
+        latency = entry["latency_ewma"] or self.default_latency
+        return latency / success_rate
+
+    def ordered(self, attempts):
+        """Attempts worth trying, healthiest and fastest first; cooling circuits are dropped"""
+        now = time.time()
+        with self._lock:
+            ranked = []
+            for position, attempt in enumerate(attempts):
+                entry = self._entry(attempt)
+                if entry["state"] == "open" and now - entry["opened_at"] < self.cooldown:
+                    continue
+                ranked.append((self._expected_cost(entry), position, attempt))
+        return [attempt for _, _, attempt in sorted(ranked)]
+
+    def acquire(self, key):
+        """Whether a call may go out now; takes the single half-open probe slot if due"""
+        with self._lock:
+            entry = self._entry(key)
+            if entry["state"] == "closed":
+                return True
+            if entry["probe_in_flight"]:
+                return False
+            if entry["state"] == "open" and time.time() - entry["opened_at"] < self.cooldown:
+                return False
+            entry["state"] = "half_open"
+            entry["probe_in_flight"] = True
+            return True
+
+    def release(self, key):
+        """Give back a probe slot that was acquired but never used"""
+        with self._lock:
+            self._entry(key)["probe_in_flight"] = False
+
+    def record_success(self, key, latency):
+        with self._lock:
+            entry = self._entry(key)
+            entry["successes"] += 1
+            entry["consecutive_failures"] = 0
+            previous = entry["latency_ewma"]
+            entry["latency_ewma"] = latency if previous is None else 0.7 * previous + 0.3 * latency
+            if entry["state"] != "closed":
+                logger.info(f"🟢 Circuit closed for {key[0]} ({key[1]})")
+            entry["state"] = "closed"
+            entry["opened_at"] = None
+            entry["probe_in_flight"] = False
+
+    def record_failure(self, key):
+        with self._lock:
+            entry = self._entry(key)
+            entry["failures"] += 1
+            entry["consecutive_failures"] += 1
+            entry["probe_in_flight"] = False
+            if entry["state"] == "half_open" or entry["consecutive_failures"] >= self.failure_threshold:
+                if entry["state"] != "open":
+                    logger.warning(f"🔴 Circuit opened for {key[0]} ({key[1]})")
+                entry["state"] = "open"
+                entry["opened_at"] = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            board = []
+            for (model, transport), entry in self._entries.items():
+                total = entry["successes"] + entry["failures"]
+                board.append({
+                    "model": model,
+                    "transport": transport,
+                    "state": entry["state"],
+                    "successes": entry["successes"],
+                    "failures": entry["failures"],
+                    "success_rate": round(entry["successes"] / total, 3) if total else None,
+                    "latency_ewma_s": round(entry["latency_ewma"], 2) if entry["latency_ewma"] else None,
+                    "expected_cost_s": round(self._expected_cost(entry), 2)
+                })
+        return sorted(board, key=lambda row: row["expected_cost_s"])
+
+model_health = ModelHealth(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN, HTTP_TIMEOUT)
+
+# Racing upstream attempts share one pool sized like the connection pool
+hedge_executor = ForkSafeExecutor(UPSTREAM_POOL_SIZE, "image-hedge")
+
+# One long-lived image pool per worker, shared by every request
+image_executor = BoundedExecutor(IMAGE_WORKERS, IMAGE_QUEUE_SIZE, "image")
+
+# Global cap on concurrent Hugging Face calls, hedges included
+upstream_slots = threading.BoundedSemaphore(UPSTREAM_MAX_INFLIGHT)
+
+# UPSTREAM IMAGE WRITE CONFIG
+IMAGE_CHUNK_SIZE = 64 * 1024  # Bounded buffer per streamed image
+MAX_UPSTREAM_IMAGE_BYTES = 20 * 1024 * 1024
+CONTENT_TYPE_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+
+def sniff_image_extension(data):
+    """File extension for image bytes we can store as-is, None otherwise"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def write_chunks_atomic(chunks, final_path, max_bytes=MAX_UPSTREAM_IMAGE_BYTES):
+    """Stream chunks into a temp file next to final_path, then rename into place
+
+    Readers of final_path only ever see a missing or a complete file.
+    """
+    tmp_path = f"{final_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    written = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if max_bytes and written > max_bytes:
+                    raise ValueError(f"file larger than {max_bytes} bytes")
+                f.write(chunk)
+        os.replace(tmp_path, final_path)
+        return written
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def store_image_bytes(data, out_stem):
+    """Store raw upstream image bytes, re-encoding only formats we can't serve"""
+    ext = sniff_image_extension(data)
+    if ext:
+        out_fname = f"{out_stem}.{ext}"
+        view = memoryview(data)
+        write_chunks_atomic(
+            (view[i:i + IMAGE_CHUNK_SIZE] for i in range(0, len(view), IMAGE_CHUNK_SIZE)),
+            os.path.join("static", out_fname)
+        )
+        return out_fname
+    
+    out_fname = f"{out_stem}.png"
+    with Image.open(io.BytesIO(data)) as image:
+        save_image_atomic(image, os.path.join("static", out_fname))
+    return out_fname
+
+def try_with_inference_client(prompt, model, scene_name, out_stem):
     """Image generation using InferenceClient - FROM ORIGINAL WORKING CODE"""
     if not HAS_CLIENT:
         return False, "huggingface_hub.InferenceClient not installed"
     try:
-        client = InferenceClient(token=TOKEN)
+        client = get_inference_client()
         logger.info(f"InferenceClient: requesting model '{model}' for {scene_name}...")
         
-        # Generate image
-        image = client.text_to_image(prompt, model=model)
-        
-        # Handle list response
-        if isinstance(image, list):
-            image = image[0]
-        
-        # Save with scene-specific filename
-        timestamp = int(time.time())
-        out_fname = f"hf_{scene_name.lower().replace(' ', '_')}_{sanitize_filename(model)}_{timestamp}.png"
-        img_path = os.path.join("static", out_fname)
-        image.save(img_path)
+        if hasattr(client, "post"):
+            # Raw response bytes - skips the PIL decode/re-encode round trip
+            data = client.post(json={"inputs": prompt}, model=model, task="text-to-image")
+            out_fname = store_image_bytes(data, out_stem)
+        else:
+            # Newer huggingface_hub only returns decoded images
+            image = client.text_to_image(prompt, model=model)
+            
+            # Handle list response
+            if isinstance(image, list):
+                image = image[0]
+            out_fname = f"{out_stem}.png"
+            save_image_atomic(image, os.path.join("static", out_fname))
         
         logger.info(f"✅ Saved image: {out_fname}")
         return True, out_fname
@@ -409,9 +1342,9 @@ def try_with_inference_client(prompt, model, scene_name):
     except Exception as e:
         return False, f"InferenceClient error: {repr(e)}"
 
-def try_with_http_api(prompt, model, scene_name):
+def try_with_http_api(prompt, model, scene_name, out_stem):
     """Image generation using HTTP API - FROM ORIGINAL WORKING CODE"""
-    endpoint = f"https://api-inference.huggingface.co/models/{model}"
+    endpoint = f"{HF_API_BASE}/models/{model}"
     headers = {"Authorization": f"Bearer {TOKEN}"}
     payload = {
         "inputs": prompt,
@@ -420,32 +1353,34 @@ def try_with_http_api(prompt, model, scene_name):
     
     try:
         logger.info(f"HTTP: POST {endpoint} for {scene_name}...")
-        r = requests.post(endpoint, headers=headers, json=payload, timeout=HTTP_TIMEOUT)
+        r = get_upstream_session().post(endpoint, headers=headers, json=payload, timeout=HTTP_TIMEOUT, stream=True)
     except requests.exceptions.RequestException as e:
         return False, f"HTTP request failed: {e}"
 
-    status = r.status_code
-    ctype = r.headers.get("content-type", "")
-    
-    if status == 200 and ctype.startswith("image"):
-        timestamp = int(time.time())
-        out_fname = f"hf_http_{scene_name.lower().replace(' ', '_')}_{sanitize_filename(model)}_{timestamp}.png"
-        img_path = os.path.join("static", out_fname)
+    with r:
+        status = r.status_code
+        ctype = r.headers.get("content-type", "").split(";")[0].strip()
         
-        try:
-            with open(img_path, "wb") as f:
-                f.write(r.content)
-            logger.info(f"✅ Saved image: {out_fname}")
-            return True, out_fname
-        except Exception as e:
-            return False, f"Failed to write image file: {e}"
+        if status == 200 and ctype.startswith("image"):
+            ext = CONTENT_TYPE_EXTENSIONS.get(ctype)
+            try:
+                if ext:
+                    # Body goes straight from the socket to disk in bounded chunks
+                    out_fname = f"{out_stem}.{ext}"
+                    write_chunks_atomic(r.iter_content(IMAGE_CHUNK_SIZE), os.path.join("static", out_fname))
+                else:
+                    out_fname = store_image_bytes(r.content, out_stem)
+                logger.info(f"✅ Saved image: {out_fname}")
+                return True, out_fname
+            except Exception as e:
+                return False, f"Failed to write image file: {e}"
 
-    # Handle JSON error response
-    try:
-        j = r.json()
-        return False, f"Status {status}: {j}"
-    except Exception:
-        return False, f"Status {status}: {r.text[:400]}"
+        # Handle JSON error response
+        try:
+            j = r.json()
+            return False, f"Status {status}: {j}"
+        except Exception:
+            return False, f"Status {status}: {r.text[:400]}"
 
 def generate_real_image_huggingface(prompt, scene_name, art_style="cartoon"):
     """Generate REAL images using Hugging Face API - FROM ORIGINAL WORKING CODE"""
@@ -470,121 +1405,132 @@ def generate_real_image_huggingface(prompt, scene_name, art_style="cartoon"):
     style_text = style_prompts.get(art_style, "digital art, colorful")
     full_prompt = f"{clean_prompt}, {style_text}, storybook illustration, high quality"
     
+    # Any model's earlier result for this exact prompt is good enough - no network call
+    digests = {model: image_store.key(full_prompt, model, art_style) for model in MODEL_CANDIDATES}
+    for model, digest in digests.items():
+        stored = image_store.lookup(digest)
+        if stored:
+            logger.info(f"💾 Image store hit for {scene_name} ({model}): {stored}")
+            return stored
+    
     logger.info(f"🎨 REAL IMAGE GENERATION for {scene_name} with prompt: {full_prompt[:60]}...")
     
-    # Try each model in sequence - FROM ORIGINAL WORKING METHOD
-    for model in MODEL_CANDIDATES:
-        logger.info(f"🔄 Trying model: {model}")
-        
-        # 1) Try InferenceClient first (preferred)
-        if HAS_CLIENT:
-            ok, result = try_with_inference_client(full_prompt, model, scene_name)
-            if ok:
-                logger.info(f"✅ InferenceClient SUCCESS for {scene_name}! File: {result}")
-                return result
+    # InferenceClient first (preferred), then HTTP API, for each model in order
+    # reordered by the health scoreboard, with tripped circuits skipped
+    transports = (["client"] if HAS_CLIENT else []) + ["http"]
+    attempts = model_health.ordered(
+        [(model, transport) for model in MODEL_CANDIDATES for transport in transports]
+    )
+    
+    def run_attempt(attempt):
+        model, transport = attempt
+        if not model_health.acquire(attempt):
+            return False, "circuit open"
+        out_stem = f"hf_{digests[model]}"
+        if not upstream_slots.acquire(timeout=HTTP_TIMEOUT):
+            model_health.release(attempt)
+            return False, "upstream busy"
+        started = time.time()
+        try:
+            if transport == "client":
+                ok, result = try_with_inference_client(full_prompt, model, scene_name, out_stem)
             else:
-                logger.warning(f"⚠️ InferenceClient failed: {result}")
-
-        # 2) Try HTTP API fallback
-        ok, result = try_with_http_api(full_prompt, model, scene_name)
+                ok, result = try_with_http_api(full_prompt, model, scene_name, out_stem)
+        finally:
+            upstream_slots.release()
         if ok:
-            logger.info(f"✅ HTTP API SUCCESS for {scene_name}! File: {result}")
-            return result
+            model_health.record_success(attempt, time.time() - started)
+            image_store.add(digests[model], result)
         else:
-            logger.warning(f"⚠️ HTTP API failed: {result}")
-            time.sleep(2)  # Brief pause before trying next model
+            model_health.record_failure(attempt)
+        return ok, result
+    
+    if IMAGE_HEDGING:
+        result = run_hedged_attempts(attempts, run_attempt, scene_name)
+    else:
+        result = run_sequential_attempts(attempts, run_attempt, scene_name)
+    if result:
+        return result
     
     # If all models failed
     logger.error(f"❌ All Hugging Face models failed for {scene_name}")
     return None
 
+def run_sequential_attempts(attempts, run_attempt, scene_name):
+    """Try each (model, transport) in sequence - FROM ORIGINAL WORKING METHOD"""
+    for model, transport in attempts:
+        logger.info(f"🔄 Trying model: {model} ({transport})")
+        ok, result = run_attempt((model, transport))
+        if ok:
+            logger.info(f"✅ {transport} SUCCESS for {scene_name}! File: {result}")
+            return result
+        logger.warning(f"⚠️ {transport} failed: {result}")
+        if transport == "http" and result not in ("circuit open", "upstream busy"):
+            time.sleep(2)  # Brief pause before trying next model
+    return None
+
+def run_hedged_attempts(attempts, run_attempt, scene_name):
+    """Race (model, transport) attempts: start the next one after HEDGE_DELAY, first success wins"""
+    remaining = iter(attempts)
+    pending = {}  # future -> attempt
+    
+    def launch():
+        attempt = next(remaining, None)
+        if attempt is None:
+            return False
+        logger.info(f"🔄 Trying model: {attempt[0]} ({attempt[1]})")
+        pending[hedge_executor.submit(run_attempt, attempt)] = attempt
+        return True
+    
+    launch()
+    try:
+        while pending:
+            # Only wait for the hedge delay while there is room for another racer
+            timeout = HEDGE_DELAY if len(pending) < HEDGE_MAX_PARALLEL else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if launch():
+                    logger.info(f"⏱️ Hedging {scene_name}: no answer after {HEDGE_DELAY}s, racing another model")
+                continue
+            
+            for future in done:
+                model, transport = pending.pop(future)
+                try:
+                    ok, result = future.result()
+                except Exception as e:
+                    ok, result = False, repr(e)
+                if ok:
+                    logger.info(f"✅ {transport} SUCCESS for {scene_name} via {model}! File: {result}")
+                    return result
+                logger.warning(f"⚠️ {transport} failed for {model}: {result}")
+                launch()  # Replace the failed racer right away
+        return None
+    finally:
+        # Losers that have not started are dropped; in-flight ones finish into the image store
+        for future in pending:
+            future.cancel()
+
 def create_beautiful_fallback(scene_name, story_text, art_style):
     """Create beautiful fallback image when API fails"""
     try:
-        logger.info(f"🎨 Creating fallback image for {scene_name}...")
-        
-        # Create high-quality fallback
-        img = Image.new('RGB', (512, 512), color='#1a1a2e')
-        draw = ImageDraw.Draw(img)
-        
-        # Art style color schemes
-        color_schemes = {
-            "cartoon": {"bg": "#ff6b6b", "accent": "#4ecdc4", "text": "#ffffff"},
-            "realistic": {"bg": "#2c3e50", "accent": "#3498db", "text": "#ecf0f1"},
-            "anime": {"bg": "#8e44ad", "accent": "#f39c12", "text": "#ffffff"},
-            "watercolor": {"bg": "#74b9ff", "accent": "#fd79a8", "text": "#2d3436"},
-            "default": {"bg": "#4a5568", "accent": "#ed8936", "text": "#f7fafc"}
-        }
-        
-        colors = color_schemes.get(art_style, color_schemes["default"])
-        
-        # Create gradient background
-        bg_rgb = tuple(int(colors["bg"][i:i+2], 16) for i in (1, 3, 5))
-        accent_rgb = tuple(int(colors["accent"][i:i+2], 16) for i in (1, 3, 5))
+        preview = story_text[:50] + "..." if len(story_text) > 50 else story_text
         
-        for y in range(512):
-            blend = y / 512
-            r = int(bg_rgb[0] * (1-blend) + accent_rgb[0] * blend)
-            g = int(bg_rgb[1] * (1-blend) + accent_rgb[1] * blend)
-            b = int(bg_rgb[2] * (1-blend) + accent_rgb[2] * blend)
-            draw.line([(0, y), (512, y)], fill=(r, g, b))
-        
-        # Add decorative elements
-        scene_elements = {
-            "Introduction": "✨ 🏰 ✨",
-            "Rising Action": "⚡ 🗡️ ⚡", 
-            "Climax": "💥 ⭐ 💥",
-            "Resolution": "🌟 👑 🌟"
-        }
+        # Same scene, style and text always render the same image - reuse it
+        digest = hashlib.md5(f"{scene_name}\x1f{art_style}\x1f{preview}".encode()).hexdigest()[:16]
+        img_filename = f"fallback_{scene_name.lower().replace(' ', '_')}_{digest}.png"
+        img_path = os.path.join("static", img_filename)
+        if os.path.exists(img_path):
+            logger.info(f"💾 Reusing fallback image: {img_filename}")
+            return img_filename
         
-        decoration = scene_elements.get(scene_name, "🎨 ✨ 🎨")
+        logger.info(f"🎨 Creating fallback image for {scene_name}...")
         
-        # Load fonts
         try:
-            title_font = ImageFont.truetype("arial.ttf", 32)
-            text_font = ImageFont.truetype("arial.ttf", 16)
-        except:
-            title_font = ImageFont.load_default()
-            text_font = ImageFont.load_default()
-        
-        # Add text content
-        lines = [
-            decoration,
-            "",
-            scene_name.upper(),
-            "",
-            "🎨 AI Image Loading...", 
-            "Real images coming soon",
-            "",
-            "📖 Story Preview:",
-            story_text[:50] + "..." if len(story_text) > 50 else story_text,
-            "",
-            f"🎭 Style: {art_style.title()}",
-            "✨ Please wait..."
-        ]
-        
-        y_pos = 80
-        for i, line in enumerate(lines):
-            if line:
-                font = title_font if i in [0, 2] else text_font
-                color = accent_rgb if i in [0, 2] else (255, 255, 255)
-                
-                # Center text
-                bbox = draw.textbbox((0, 0), line, font=font)
-                text_width = bbox[2] - bbox[0]
-                x_pos = (512 - text_width) // 2
-                
-                # Add shadow
-                draw.text((x_pos + 1, y_pos + 1), line, fill=(0, 0, 0, 128), font=font)
-                draw.text((x_pos, y_pos), line, fill=color, font=font)
-            
-            y_pos += 35 if i in [0, 2] else 25
-        
-        # Save fallback image
-        timestamp = int(time.time())
-        img_filename = f"fallback_{scene_name.lower().replace(' ', '_')}_{timestamp}.png"
-        img_path = os.path.join("static", img_filename)
-        img.save(img_path, "PNG", quality=95)
+            render_pool.run(render_fallback_image, scene_name, preview, art_style, img_path)
+        except (PoolBusyError, TimeoutError, BrokenProcessPool) as e:
+            # The fallback is the last resort, so draw it here rather than fail
+            logger.warning(f"⚠️ Render pool unavailable ({e}), drawing {scene_name} fallback inline")
+            render_fallback_image(scene_name, preview, art_style, img_path)
         
         logger.info(f"✅ Created fallback image: {img_filename}")
         return img_filename
@@ -593,15 +1539,42 @@ def create_beautiful_fallback(scene_name, story_text, art_style):
         logger.error(f"❌ Error creating fallback image: {e}")
         return None
 
+def get_image_hash(prompt, scene_name, art_style):
+    """Create hash for image caching"""
+    content = f"{prompt}_{scene_name}_{art_style}"
+    return hashlib.md5(content.encode()).hexdigest()[:16]
+
+def get_cached_image(cache_key):
+    """Look up a previously generated real image in the local and shared caches"""
+    filename = image_cache.get(cache_key) or shared_cache.get(f"image:{cache_key}")
+    if filename and os.path.exists(os.path.join("static", filename)):
+        image_cache.set(cache_key, filename)
+        return filename
+    
+    # File was cleaned up - forget the stale entry everywhere
+    if filename:
+        image_cache.pop(cache_key, None)
+        shared_cache.delete(f"image:{cache_key}")
+    return None
+
 def generate_image_with_fallback(prompt, scene_name, art_style="cartoon"):
     """Generate real image with fallback - RESTORED WORKING METHOD"""
     
+    # Method 0: Reuse a real image any worker already generated for this prompt
+    cache_key = get_image_hash(prompt, scene_name, art_style)
+    cached = get_cached_image(cache_key)
+    if cached:
+        logger.info(f"💾 Image cache hit for {scene_name}: {cached}")
+        return cached
+    
     # Method 1: Try Hugging Face API (REAL IMAGES)
     try:
         logger.info(f"🎨 Method 1: Hugging Face API for {scene_name}...")
         result = generate_real_image_huggingface(prompt, scene_name, art_style)
         if result:
             logger.info(f"🎉 REAL IMAGE SUCCESS for {scene_name}!")
+            image_cache.set(cache_key, result)
+            shared_cache.set(f"image:{cache_key}", result, ttl=IMAGE_CACHE_TTL)
             return result
     except Exception as e:
         logger.warning(f"⚠️ Method 1 failed: {e}")
@@ -620,6 +1593,155 @@ def generate_image_with_fallback(prompt, scene_name, art_style="cartoon"):
     logger.error(f"❌ All methods failed for {scene_name}")
     return None
 
+SCENES = ["Introduction", "Rising Action", "Climax", "Resolution"]
+
+# BACKGROUND JOB CONFIG
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # Stories generated concurrently per worker
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '32'))  # Jobs waiting beyond the running ones
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))  # Job records kept for 1 hour
+JOB_SUBMIT_TIMEOUT = 300  # Jobs wait this long for room on the image pool
+
+def parse_story_options(data):
+    """Validate a generation request body, returns (options, error)"""
+    story_idea = data.get("story_idea", "").strip()
+    if not story_idea:
+        return None, "Story idea required"
+    return {
+        "story_idea": story_idea,
+        "genre": data.get("genre", "fantasy"),
+        "tone": data.get("tone", "lighthearted"),
+        "art_style": data.get("art_style", "cartoon"),
+        "audience": data.get("audience", "all"),
+        "characters": data.get("characters", [])
+    }, None
+
+def build_scene_prompt(scene, story, story_idea, characters, art_style):
+    """Create more specific prompts for each scene"""
+    scene_prompts = {
+        "Introduction": f"opening scene, {story_idea}, beginning of adventure, {', '.join(characters) if characters else 'main character'}, {art_style} style",
+        "Rising Action": f"action scene, {story_idea}, challenges and obstacles, {', '.join(characters) if characters else 'heroes'}, {art_style} style",
+        "Climax": f"dramatic climax, {story_idea}, most exciting moment, {', '.join(characters) if characters else 'protagonist'}, {art_style} style",
+        "Resolution": f"happy ending, {story_idea}, celebration, {', '.join(characters) if characters else 'characters'}, {art_style} style"
+    }
+    
+    # Use enhanced prompt or fallback to original
+    return scene_prompts.get(scene, f"{story_idea}, {story[scene][:60]}, {scene.lower()}")
+
+def generate_scene_image(scene, story, options):
+    """Generate the image for one scene, returns (scene, filename or None)"""
+    try:
+        enhanced_prompt = build_scene_prompt(
+            scene, story, options["story_idea"], options["characters"], options["art_style"]
+        )
+        result = generate_image_with_fallback(enhanced_prompt, scene, options["art_style"])
+        return scene, result
+    except Exception as e:
+        logger.error(f"Error in generate_scene_image for {scene}: {e}")
+        return scene, None
+
+def build_metadata(options, images, generation_time):
+    """Response metadata shared by /generate and the job API"""
+    return {
+        "genre": options["genre"],
+        "tone": options["tone"],
+        "art_style": options["art_style"],
+        "audience": options["audience"],
+        "images_generated": sum(1 for img in images.values() if img is not None),
+        "total_scenes": len(SCENES),
+        "generation_time": f"{generation_time:.2f}s",
+        "story_method": "lightning_templates",
+        "image_method": "huggingface_api_real_images",
+        "generation_method": "restored_working_method"
+    }
+
+# In-flight deduplication: whole generations and individual scene images
+generation_flight = SingleFlight()
+scene_flight = SingleFlight()
+
+def get_scene_flight_key(scene, story, options):
+    prompt = build_scene_prompt(scene, story, options["story_idea"], options["characters"], options["art_style"])
+    return get_image_hash(prompt, scene, options["art_style"])
+
+def submit_scene_images(story, options, timeout=None, priority=PRIORITY_INTERACTIVE):
+    """Queue all scene images on the shared image pool, returns {future: scene}
+
+    Scenes already being generated for any request are joined rather
+    than queued again. Raises PoolBusyError when the pool has no room
+    (after waiting up to timeout seconds when one is given).
+    Pass the result to release_scene_images when done waiting on it.
+    """
+    keys = {scene: get_scene_flight_key(scene, story, options) for scene in SCENES}
+    future_to_scene = {}
+    led = []
+    for scene in SCENES:
+        future, leader = scene_flight.join_or_lead(keys[scene])
+        future_to_scene[future] = scene
+        if leader:
+            led.append((scene, future))
+    
+    try:
+        tasks = image_executor.submit_all(
+            [(generate_scene_image, (scene, story, options)) for scene, _ in led],
+            timeout=timeout, priority=priority
+        )
+    except PoolBusyError as e:
+        for _, future in led:
+            scene_flight.fail(future, e)
+        release_scene_images(future_to_scene, story, options)
+        raise
+    for (scene, future), task in zip(led, tasks):
+        scene_flight.attach(keys[scene], future, task)
+    
+    if len(led) < len(SCENES):
+        logger.info(f"🔗 Joined {len(SCENES) - len(led)} in-flight scene images")
+    return future_to_scene
+
+def release_scene_images(future_to_scene, story, options):
+    """Let go of scene futures; work nobody else waits for is cancelled"""
+    for future, scene in future_to_scene.items():
+        scene_flight.release(get_scene_flight_key(scene, story, options), future)
+
+def busy_response(error):
+    """Fast 503 with Retry-After instead of piling more work onto a full pool"""
+    response = jsonify({"success": False, "error": str(error), "retry_after": RETRY_AFTER_SECONDS})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response
+
+def run_generation(options):
+    """Story plus all scene images for one request, returns (story, images)"""
+    # PHASE 1: INSTANT story generation
+    story = generate_lightning_story(
+        options["story_idea"], options["genre"], options["tone"],
+        options["audience"], options["characters"], options["art_style"]
+    )
+    
+    # PHASE 2: PARALLEL image generation with REAL images on the shared image pool
+    images = {}
+    future_to_scene = submit_scene_images(story, options)
+    
+    # Collect results as they complete
+    try:
+        for future in as_completed(future_to_scene, timeout=60):  # Allow more time for real images
+            try:
+                scene, img_filename = future.result()
+                if img_filename:
+                    images[scene] = f"/static/{img_filename}"
+                else:
+                    images[scene] = None
+            except Exception as e:
+                scene = future_to_scene[future]
+                images[scene] = None
+                logger.error(f"Error generating image for {scene}: {e}")
+    finally:
+        release_scene_images(future_to_scene, story, options)
+
+    # Ensure all scenes have entries
+    for scene in SCENES:
+        if scene not in images:
+            images[scene] = None
+    return story, images
+
 @app.route('/generate', methods=['POST'])
 def generate():
     """FAST generation with REAL images"""
@@ -630,88 +1752,28 @@ def generate():
         if not request.is_json:
             return jsonify({"error": "JSON required"}), 400
             
-        data = request.json
-        story_idea = data.get("story_idea", "").strip()
-        genre = data.get("genre", "fantasy")
-        tone = data.get("tone", "lighthearted")
-        art_style = data.get("art_style", "cartoon")
-        audience = data.get("audience", "all")
-        characters = data.get("characters", [])
-
-        if not story_idea:
-            return jsonify({"error": "Story idea required"}), 400
-
-        # PHASE 1: INSTANT story generation
-        story = generate_lightning_story(story_idea, genre, tone, audience, characters, art_style)
-        
-        # PHASE 2: PARALLEL image generation with REAL images
-        scenes = ["Introduction", "Rising Action", "Climax", "Resolution"]
-        images = {}
-        
-        def generate_scene_image(scene):
-            try:
-                # Create more specific prompts for each scene
-                scene_prompts = {
-                    "Introduction": f"opening scene, {story_idea}, beginning of adventure, {', '.join(characters) if characters else 'main character'}, {art_style} style",
-                    "Rising Action": f"action scene, {story_idea}, challenges and obstacles, {', '.join(characters) if characters else 'heroes'}, {art_style} style",
-                    "Climax": f"dramatic climax, {story_idea}, most exciting moment, {', '.join(characters) if characters else 'protagonist'}, {art_style} style",
-                    "Resolution": f"happy ending, {story_idea}, celebration, {', '.join(characters) if characters else 'characters'}, {art_style} style"
-                }
-                
-                # Use enhanced prompt or fallback to original
-                enhanced_prompt = scene_prompts.get(scene, f"{story_idea}, {story[scene][:60]}, {scene.lower()}")
-                result = generate_image_with_fallback(enhanced_prompt, scene, art_style)
-                return scene, result
-            except Exception as e:
-                logger.error(f"Error in generate_scene_image for {scene}: {e}")
-                return scene, None
-        
-        # Use ThreadPoolExecutor for parallel image generation
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_scene = {
-                executor.submit(generate_scene_image, scene): scene 
-                for scene in scenes
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_scene, timeout=60):  # Allow more time for real images
-                try:
-                    scene, img_filename = future.result()
-                    if img_filename:
-                        images[scene] = f"/static/{img_filename}"
-                    else:
-                        images[scene] = None
-                except Exception as e:
-                    scene = future_to_scene[future]
-                    images[scene] = None
-                    logger.error(f"Error generating image for {scene}: {e}")
+        options, error = parse_story_options(request.json)
+        if error:
+            return jsonify({"error": error}), 400
 
-        # Ensure all scenes have entries
-        for scene in scenes:
-            if scene not in images:
-                images[scene] = None
+        # Identical requests already in flight share one generation
+        flight_key = get_generation_key(options)
+        try:
+            story, images = generation_flight.do(flight_key, run_generation, options)
+        except PoolBusyError as e:
+            logger.warning(f"🚦 Rejecting /generate: {e}")
+            return busy_response(e)
 
         generation_time = time.time() - start_time
-        successful_images = sum(1 for img in images.values() if img is not None)
+        metadata = build_metadata(options, images, generation_time)
         
-        logger.info(f"⚡ GENERATION COMPLETE: {generation_time:.2f}s, {successful_images}/4 images")
+        logger.info(f"⚡ GENERATION COMPLETE: {generation_time:.2f}s, {metadata['images_generated']}/4 images")
 
         return jsonify({
             "success": True,
             "story": story,
             "images": images,
-            "metadata": {
-                "genre": genre,
-                "tone": tone,
-                "art_style": art_style,
-                "audience": audience,
-                "images_generated": successful_images,
-                "total_scenes": len(scenes),
-                "generation_time": f"{generation_time:.2f}s",
-                "story_method": "lightning_templates",
-                "image_method": "huggingface_api_real_images",
-                "generation_method": "restored_working_method"
-            }
+            "metadata": metadata
         })
 
     except Exception as e:
@@ -721,16 +1783,378 @@ def generate():
             "error": f"Server error: {str(e)}"
         }), 500
 
+# BATCH GENERATION CONFIG
+BATCH_GENERATE_MAX_STORIES = int(os.getenv('BATCH_GENERATE_MAX_STORIES', '20'))
+# Stories with images in flight per batch - every image worker plus a quarter of the queue,
+# so interactive requests still find room
+BATCH_GENERATE_WINDOW = int(os.getenv('BATCH_GENERATE_WINDOW', str(max(1, (IMAGE_WORKERS + IMAGE_QUEUE_SIZE // 4) // len(SCENES)))))
+# A sync gunicorn worker sends no heartbeat while it streams, so a batch must end
+# before gunicorn's 120s timeout kills it. Raise this only with a gthread/gevent worker.
+BATCH_GENERATE_TIMEOUT = int(os.getenv('BATCH_GENERATE_TIMEOUT_SECONDS', '100'))
+
+def ndjson_line(data):
+    return json.dumps(data) + "\n"
+
+def get_generation_key(options):
+    """Identical story options produce identical stories and images"""
+    return get_story_hash(
+        options["story_idea"], options["genre"], options["tone"],
+        options["audience"], options["characters"]
+    ) + f"_{options['art_style']}"
+
+def stream_batch_generation(specs, start_time):
+    """Yield one NDJSON line per story as its images finish, then a summary line
+
+    Duplicate specs in the batch are generated once. Every story is built
+    up front (the template stage is microseconds), then images go through
+    the shared image pool at batch priority, a window of stories at a
+    time, joining any identical scene already in flight in this worker.
+    Stories still unfinished after BATCH_GENERATE_TIMEOUT are reported as
+    failed so the response ends before the worker timeout.
+    """
+    failed = 0
+    groups = OrderedDict()  # generation key -> (options, [indexes])
+    for index, spec in enumerate(specs):
+        options, error = parse_story_options(spec) if isinstance(spec, dict) else (None, "Story spec must be an object")
+        if error:
+            failed += 1
+            yield ndjson_line({"index": index, "success": False, "error": error})
+            continue
+        groups.setdefault(get_generation_key(options), (options, []))[1].append(index)
+    
+    # PHASE 1: template stage for the whole batch in one pass
+    stories = {
+        key: generate_lightning_story(
+            options["story_idea"], options["genre"], options["tone"],
+            options["audience"], options["characters"], options["art_style"]
+        )
+        for key, (options, _) in groups.items()
+    }
+    
+    # PHASE 2: images on the shared prioritized pool
+    queue = deque(groups)
+    in_flight = {}  # generation key -> (future_to_scene, submitted_at)
+    deadline = start_time + BATCH_GENERATE_TIMEOUT
+    try:
+        while (queue or in_flight) and time.time() < deadline:
+            while queue and len(in_flight) < BATCH_GENERATE_WINDOW:
+                key = queue[0]
+                try:
+                    future_to_scene = submit_scene_images(stories[key], groups[key][0], priority=PRIORITY_BATCH)
+                except PoolBusyError:
+                    break
+                queue.popleft()
+                in_flight[key] = (future_to_scene, time.time())
+            
+            if not in_flight:
+                # Pool is full of other requests' work - sleep until it has room for a story
+                image_executor.wait_for_room(len(SCENES), timeout=deadline - time.time())
+                continue
+            
+            # Stories in the window can share scene futures (their image
+            # prompts match), so every story is re-checked after each wait
+            pending = {
+                future for future_to_scene, _ in in_flight.values()
+                for future in future_to_scene if not future.done()
+            }
+            if pending:
+                wait(pending, timeout=max(0, deadline - time.time()), return_when=FIRST_COMPLETED)
+            finished = [
+                key for key, (future_to_scene, _) in in_flight.items()
+                if all(future.done() for future in future_to_scene)
+            ]
+            for key in finished:
+                future_to_scene, submitted_at = in_flight.pop(key)
+                options, indexes = groups[key]
+                images = {scene: None for scene in SCENES}
+                for future, scene in future_to_scene.items():
+                    try:
+                        _, img_filename = future.result()
+                        images[scene] = f"/static/{img_filename}" if img_filename else None
+                    except Exception as e:
+                        logger.error(f"Error generating image for {scene}: {e}")
+                release_scene_images(future_to_scene, stories[key], options)
+                metadata = build_metadata(options, images, time.time() - submitted_at)
+                for index in indexes:
+                    yield ndjson_line({
+                        "index": index,
+                        "success": True,
+                        "story": stories[key],
+                        "images": images,
+                        "metadata": metadata
+                    })
+        
+        # Out of time - end the response cleanly rather than be killed mid-stream
+        unfinished = list(in_flight) + list(queue)
+        for key in unfinished:
+            for index in groups[key][1]:
+                failed += 1
+                yield ndjson_line({
+                    "index": index,
+                    "success": False,
+                    "error": f"Batch time limit of {BATCH_GENERATE_TIMEOUT}s reached, submit this story again"
+                })
+        if unfinished:
+            logger.warning(f"⏱️ Batch time limit reached with {len(unfinished)} stories unfinished")
+        
+        logger.info(f"⚡ BATCH COMPLETE: {len(specs)} stories ({len(groups)} unique) in {time.time() - start_time:.2f}s")
+        yield ndjson_line({
+            "complete": True,
+            "stories": len(specs),
+            "unique": len(groups),
+            "failed": failed,
+            "generation_time": f"{time.time() - start_time:.2f}s"
+        })
+    finally:
+        # Client went away or we failed - drop work nobody else is waiting for
+        for key, (future_to_scene, _) in in_flight.items():
+            release_scene_images(future_to_scene, stories[key], groups[key][0])
+
+@app.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """Generate many stories in one request, streaming each as NDJSON when its images are done"""
+    if not request.is_json:
+        return jsonify({"error": "JSON required"}), 400
+    
+    specs = request.json.get("stories")
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "stories must be a non-empty list"}), 400
+    if len(specs) > BATCH_GENERATE_MAX_STORIES:
+        return jsonify({"error": f"At most {BATCH_GENERATE_MAX_STORIES} stories per batch"}), 400
+    
+    logger.info(f"📚 Batch generation of {len(specs)} stories")
+    response = Response(stream_batch_generation(specs, time.time()), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    """Streaming /generate: story first, then each scene image as it finishes (SSE)"""
+    start_time = time.time()
+    
+    if not request.is_json:
+        return jsonify({"error": "JSON required"}), 400
+    
+    options, error = parse_story_options(request.json)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    # Story and image queueing happen up front so a full pool is still a plain 503
+    story = generate_lightning_story(
+        options["story_idea"], options["genre"], options["tone"],
+        options["audience"], options["characters"], options["art_style"]
+    )
+    try:
+        future_to_scene = submit_scene_images(story, options)
+    except PoolBusyError as e:
+        logger.warning(f"🚦 Rejecting /generate/stream: {e}")
+        return busy_response(e)
+    
+    def event_stream():
+        images = {scene: None for scene in SCENES}
+        try:
+            yield sse_event("story", {"story": story})
+            
+            for future in as_completed(future_to_scene, timeout=60):
+                scene, img_filename = future.result()
+                images[scene] = f"/static/{img_filename}" if img_filename else None
+                yield sse_event("image", {
+                    "scene": scene,
+                    "image": images[scene],
+                    "fallback": bool(img_filename) and img_filename.startswith("fallback_")
+                })
+            
+            generation_time = time.time() - start_time
+            yield sse_event("complete", {
+                "success": True,
+                "images": images,
+                "metadata": build_metadata(options, images, generation_time)
+            })
+            logger.info(f"⚡ STREAMED GENERATION COMPLETE: {generation_time:.2f}s")
+        except Exception as e:
+            logger.error(f"Streaming generation error: {e}")
+            yield sse_event("error", {"success": False, "error": f"Server error: {str(e)}", "images": images})
+        finally:
+            # Client may have gone away - don't start scenes nobody will see
+            release_scene_images(future_to_scene, story, options)
+    
+    return Response(event_stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Disable proxy buffering so events flush immediately
+    })
+
+# Process-wide pool that runs queued story jobs
+job_executor = BoundedExecutor(JOB_WORKERS, JOB_QUEUE_SIZE, "story-job")
+
+def save_job(job):
+    """Publish job state to the shared cache so any worker can answer polls"""
+    job["updated_at"] = time.time()
+    shared_cache.set(f"job:{job['job_id']}", job, ttl=JOB_TTL)
+
+def run_story_job(job):
+    """Generate story then images for a queued job, publishing progress as it goes"""
+    start_time = time.time()
+    options = job["options"]
+    try:
+        job["status"] = "running"
+        story = generate_lightning_story(
+            options["story_idea"], options["genre"], options["tone"],
+            options["audience"], options["characters"], options["art_style"]
+        )
+        job["story"] = story
+        save_job(job)
+        
+        # Background work may wait for room on the image pool instead of failing
+        future_to_scene = submit_scene_images(
+            story, options, timeout=JOB_SUBMIT_TIMEOUT, priority=PRIORITY_BACKGROUND
+        )
+        try:
+            for future in as_completed(future_to_scene):
+                scene, img_filename = future.result()
+                job["images"][scene] = f"/static/{img_filename}" if img_filename else None
+                job["scenes_done"].append(scene)
+                save_job(job)
+        finally:
+            release_scene_images(future_to_scene, story, options)
+        
+        job["status"] = "complete"
+        job["metadata"] = build_metadata(options, job["images"], time.time() - start_time)
+        save_job(job)
+        logger.info(f"⚡ JOB {job['job_id']} COMPLETE: {time.time() - start_time:.2f}s")
+    except Exception as e:
+        logger.error(f"Job {job['job_id']} failed: {e}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+        save_job(job)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a generation job and return its id immediately"""
+    if not request.is_json:
+        return jsonify({"error": "JSON required"}), 400
+    
+    options, error = parse_story_options(request.json)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "status": "queued",
+        "options": options,
+        "story": None,
+        "images": {scene: None for scene in SCENES},
+        "scenes_done": [],
+        "metadata": None,
+        "error": None,
+        "created_at": time.time()
+    }
+    save_job(job)
+    try:
+        job_executor.submit(run_story_job, job)
+    except PoolBusyError as e:
+        logger.warning(f"🚦 Rejecting /jobs: {e}")
+        shared_cache.delete(f"job:{job_id}")
+        return busy_response(e)
+    
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "poll_url": f"/jobs/{job_id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Current state of a job: story as soon as it exists, images as they finish"""
+    job = shared_cache.get(f"job:{job_id}")
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    job.pop("options", None)
+    job["success"] = job["status"] != "failed"
+    return jsonify(job)
+
 @app.route('/static/<filename>')
 def serve_static(filename):
-    """Serve static files with caching"""
+    """Serve static files with caching, images resized/re-encoded on request
+
+    Images accept ?w=<width> and ?fmt=webp|jpeg|png; without fmt the format
+    is negotiated from the Accept header. ?fmt=original skips conversion.
+    """
     try:
-        response = send_from_directory('static', filename)
+        variant = choose_derivative(filename)
+        if variant:
+            derived_path, mimetype = variant
+            response = send_file(os.path.abspath(derived_path), mimetype=mimetype)
+        else:
+            response = send_from_directory('static', filename)
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            response.vary.add("Accept")
         response.cache_control.max_age = 3600  # 1 hour cache
         return response
     except Exception:
         return jsonify({"error": "File not found"}), 404
 
+derivative_writes = 0
+derivative_lock = threading.Lock()
+
+def choose_derivative(filename):
+    """Pick and build the derivative for this request, None to serve the original"""
+    if not filename.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    fmt = request.args.get("fmt", "").lower()
+    width = request.args.get("w", type=int)
+    if fmt == "original":
+        return None
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in DERIVATIVE_FORMATS:
+        # Only when listed by name - */* and image/* also match "image/webp"
+        # but older Safari sends those and cannot decode WebP
+        fmt = "webp" if "image/webp" in request.accept_mimetypes.values() else None
+    if not fmt and not width:
+        return None
+    
+    source_path = safe_join('static', filename)
+    if source_path is None or not os.path.isfile(source_path):
+        return None
+    if width:
+        width = next((w for w in DERIVATIVE_WIDTHS if w >= width), DERIVATIVE_WIDTHS[-1])
+    return get_derivative(source_path, width, fmt or "png")
+
+def get_derivative(source_path, width, fmt):
+    """Return (path, mimetype) of a cached derivative, building it on first use"""
+    global derivative_writes
+    pil_format, mimetype, save_options = DERIVATIVE_FORMATS[fmt]
+    derived_path = os.path.join(DERIVATIVE_DIR, f"{os.path.basename(source_path)}.w{width or 0}.{fmt}")
+    
+    # Fresh derivative on disk: bump its recency for the LRU trim and serve it
+    if os.path.exists(derived_path) and os.path.getmtime(derived_path) >= os.path.getmtime(source_path):
+        os.utime(derived_path)
+        return derived_path, mimetype
+    
+    with Image.open(source_path) as img:
+        img.load()
+        if width and img.width > width:  # Never upscale
+            height = round(img.height * width / img.width)
+            img = img.resize((width, height), Image.LANCZOS)
+        if pil_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        save_image_atomic(img, derived_path, pil_format, **save_options)
+    
+    with derivative_lock:
+        derivative_writes += 1
+        should_trim = derivative_writes % 50 == 0
+    if should_trim:
+        trim_derivative_cache()
+    return derived_path, mimetype
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint for health checks"""
@@ -742,7 +2166,11 @@ def root():
             "health": "/health",
             "test": "/test", 
             "generate": "/generate",
+            "generate_stream": "/generate/stream",
+            "generate_batch": "/generate/batch",
+            "jobs": "/jobs",
             "download_pdf": "/download-pdf",
+            "download_pdf_batch": "/download-pdf/batch",
             "stats": "/stats"
         }
     })
@@ -755,6 +2183,7 @@ def health_check():
         "story_generation": "instant_templates",
         "image_generation": "huggingface_api_real_images",
         "cache_status": f"Stories: {len(story_cache)}, Images: {len(image_cache)}",
+        "shared_cache": shared_cache.name,
         "has_inference_client": HAS_CLIENT,
         "token_configured": bool(TOKEN)
     })
@@ -808,345 +2237,75 @@ def manual_cleanup():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def create_storybook_pdf(story_data, images_data, story_options):
-    """Create a beautiful, branded storybook PDF with decorative elements and page borders"""
-    try:
-        if not HAS_REPORTLAB:
-            return None, "PDF generation not available - reportlab not installed"
-        
-        # Create PDF filename
-        timestamp = int(time.time())
-        story_title = story_data.get('title', 'My Story').replace(' ', '_')
-        pdf_filename = f"storybook_{story_title}_{timestamp}.pdf"
-        pdf_path = os.path.join("static", pdf_filename)
-        
-        # Custom page template with decorative borders
-        def add_page_border(canvas, doc):
-            """Add decorative border to each page"""
-            # Page dimensions
-            width, height = A4
-            margin = 30
-            
-            # Set line width for border
-            canvas.setLineWidth(3)
-            
-            # Outer decorative border (thick)
-            canvas.setStrokeColor(colors.HexColor('#f97316'))  # Orange
-            canvas.rect(margin, margin, width - 2*margin, height - 2*margin, fill=0, stroke=1)
-            
-            # Inner decorative border (thin)
-            canvas.setLineWidth(1)
-            canvas.setStrokeColor(colors.HexColor('#2c5530'))  # Green
-            canvas.rect(margin + 15, margin + 15, width - 2*(margin + 15), height - 2*(margin + 15), fill=0, stroke=1)
-            
-            # Corner decorations
-            corner_size = 20
-            corners = [
-                (margin + 5, height - margin - 5),  # Top left
-                (width - margin - 5, height - margin - 5),  # Top right
-                (margin + 5, margin + 5),  # Bottom left
-                (width - margin - 5, margin + 5),  # Bottom right
-            ]
-            
-            canvas.setFillColor(colors.HexColor('#f97316'))
-            for x, y in corners:
-                canvas.circle(x, y, 8, fill=1, stroke=0)
-                canvas.setFillColor(colors.HexColor('#2c5530'))
-                canvas.circle(x, y, 4, fill=1, stroke=0)
-                canvas.setFillColor(colors.HexColor('#f97316'))
-        
-        # Create the PDF document with custom template
-        doc = SimpleDocTemplate(pdf_path, pagesize=A4, 
-                              leftMargin=1*inch, rightMargin=1*inch,
-                              topMargin=1*inch, bottomMargin=1*inch)
-        
-        # Get styles and create custom ones
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Brand colors for different page types
-        colors_scheme = {
-            'cover': {'bg': colors.HexColor('#f0f9f0'), 'border': colors.HexColor('#2c5530')},
-            'introduction': {'bg': colors.HexColor('#fff7ed'), 'border': colors.HexColor('#f97316')},
-            'rising_action': {'bg': colors.HexColor('#fef3f2'), 'border': colors.HexColor('#dc2626')},
-            'climax': {'bg': colors.HexColor('#f3f4f6'), 'border': colors.HexColor('#374151')},
-            'resolution': {'bg': colors.HexColor('#f0fdf4'), 'border': colors.HexColor('#16a34a')}
-        }
-        
-        # Enhanced decorative styles
-        title_style = ParagraphStyle(
-            'BrandTitle',
-            parent=styles['Heading1'],
-            fontSize=36,
-            spaceAfter=50,
-            spaceBefore=30,
-            alignment=1,  # Center
-            textColor=colors.HexColor('#2c5530'),
-            fontName='Helvetica-Bold',
-            borderWidth=4,
-            borderColor=colors.HexColor('#f97316'),
-            borderPadding=20,
-            backColor=colors.HexColor('#f0f9f0'),
-            borderRadius=15
-        )
-        
-        brand_subtitle = ParagraphStyle(
-            'BrandSubtitle',
-            parent=styles['Heading2'],
-            fontSize=20,
-            spaceAfter=25,
-            spaceBefore=15,
-            alignment=1,
-            textColor=colors.HexColor('#f97316'),
-            fontName='Helvetica-Bold'
-        )
-        
-        chapter_style = ParagraphStyle(
-            'DecorativeChapter',
-            parent=styles['Heading2'], 
-            fontSize=26,
-            spaceAfter=25,
-            spaceBefore=35,
-            alignment=1,
-            textColor=colors.HexColor('#2c5530'),
-            fontName='Helvetica-Bold',
-            borderWidth=3,
-            borderColor=colors.HexColor('#f97316'),
-            borderPadding=15,
-            backColor=colors.HexColor('#fff7ed'),
-            leftIndent=40,
-            rightIndent=40,
-            borderRadius=12
-        )
-        
-        story_style = ParagraphStyle(
-            'StoryText',
-            parent=styles['Normal'],
-            fontSize=16,
-            spaceAfter=25,
-            spaceBefore=15,
-            leftIndent=40,
-            rightIndent=40,
-            leading=24,
-            fontName='Helvetica',
-            textColor=colors.HexColor('#1f2937'),
-            backColor=colors.HexColor('#fefefe'),
-            borderPadding=15
-        )
-        
-        info_style = ParagraphStyle(
-            'InfoText',
-            parent=styles['Normal'],
-            fontSize=13,
-            spaceAfter=20,
-            leftIndent=30,
-            rightIndent=30,
-            textColor=colors.HexColor('#6b7280'),
-            backColor=colors.HexColor('#f8fafc'),
-            borderWidth=2,
-            borderColor=colors.HexColor('#e2e8f0'),
-            borderPadding=15,
-            borderRadius=10
-        )
-        
-        # === COVER PAGE ===
-        # Brand header with decorative elements
-        story.append(Paragraph("✨📚 EpicTales AI 📚✨", brand_subtitle))
-        story.append(Spacer(1, 0.4*inch))
-        
-        # Main title with enhanced decoration
-        title_text = story_data.get('title', 'My Epic Story')
-        story.append(Paragraph(f"🌟 {title_text} 🌟", title_style))
-        story.append(Spacer(1, 0.5*inch))
-        
-        # Story information with enhanced formatting
-        characters_text = ", ".join(story_options.get('characters', [])) if story_options.get('characters') else "Various Characters"
-        
-        info_html = f"""
-        <b>� ✨ Story Information ✨ 📚</b><br/>
-        <br/>
-        🎭 <b>Genre:</b> {story_options.get('genre', 'Fantasy').title()}<br/>
-        🎨 <b>Art Style:</b> {story_options.get('art_style', 'Cartoon').title()}<br/>
-        😊 <b>Tone:</b> {story_options.get('tone', 'Lighthearted').title()}<br/>
-        👥 <b>Target Audience:</b> {story_options.get('audience', 'All ages').title()}<br/>
-        🎪 <b>Main Characters:</b> {characters_text}<br/>
-        <br/>
-        <i>🌟 Crafted with Magic by EpicTales AI 🌟</i><br/>
-        <i>Where Stories Come to Life! ✨</i>
-        """
-        
-        story.append(Paragraph(info_html, info_style))
-        story.append(Spacer(1, 0.5*inch))
-        
-        # Add cover image with decorative frame
-        if images_data.get('Introduction'):
-            intro_image_url = images_data['Introduction']
-            if intro_image_url.startswith('/static/'):
-                intro_image_path = intro_image_url[8:]
-                full_image_path = os.path.join("static", intro_image_path)
-                if os.path.exists(full_image_path):
-                    try:
-                        story.append(Paragraph("🖼️ ✨ Cover Illustration ✨ 🖼️", brand_subtitle))
-                        story.append(Spacer(1, 0.3*inch))
-                        
-                        # Create image with decorative frame effect
-                        img = RLImage(full_image_path, width=5*inch, height=3.75*inch)
-                        story.append(img)
-                        story.append(Spacer(1, 0.4*inch))
-                    except Exception as e:
-                        logger.error(f"Error adding cover image: {e}")
-        
-        # Enhanced footer for cover page
-        story.append(Spacer(1, 0.6*inch))
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=12,
-            alignment=1,
-            textColor=colors.HexColor('#8B4513'),
-            spaceAfter=15,
-            borderWidth=2,
-            borderColor=colors.HexColor('#f97316'),
-            borderPadding=10,
-            backColor=colors.HexColor('#fef3f2')
-        )
-        story.append(Paragraph("🌐 www.epictales-ai.com | Create Magical Stories with AI! 🌟", footer_style))
-        story.append(PageBreak())
-        
-        # === STORY CHAPTERS WITH COLORED PAGES ===
-        scenes = ["Introduction", "Rising Action", "Climax", "Resolution"]
-        scene_titles = {
-            "Introduction": "� Chapter 1: The Beginning",
-            "Rising Action": "⚡ Chapter 2: The Adventure Unfolds", 
-            "Climax": "🔥 Chapter 3: The Greatest Challenge",
-            "Resolution": "🌟 Chapter 4: A Happy Ending"
-        }
-        
-        scene_emojis = {
-            "Introduction": "🌅",
-            "Rising Action": "⚔️", 
-            "Climax": "💥",
-            "Resolution": "🎉"
-        }
-        
-        for i, scene in enumerate(scenes):
-            if not story_data.get(scene):
-                continue
-                
-            # Enhanced decorative chapter header
-            chapter_title = f"{scene_emojis[scene]} {scene_titles[scene]} {scene_emojis[scene]}"
-            story.append(Paragraph(chapter_title, chapter_style))
-            story.append(Spacer(1, 0.4*inch))
-            
-            # Scene image with beautiful decorative frame
-            if images_data.get(scene):
-                image_url = images_data[scene]
-                if image_url.startswith('/static/'):
-                    image_filename = image_url[8:]
-                    full_image_path = os.path.join("static", image_filename)
-                    if os.path.exists(full_image_path):
-                        try:
-                            # Add image title
-                            img_title_style = ParagraphStyle(
-                                'ImageTitle',
-                                parent=styles['Normal'],
-                                fontSize=14,
-                                alignment=1,
-                                textColor=colors.HexColor('#f97316'),
-                                fontName='Helvetica-Bold',
-                                spaceAfter=15
-                            )
-                            story.append(Paragraph(f"✨ {scene} Illustration ✨", img_title_style))
-                            
-                            # Enhanced image with frame effect
-                            story.append(Spacer(1, 0.2*inch))
-                            img = RLImage(full_image_path, width=6*inch, height=4.5*inch)
-                            story.append(img)
-                            story.append(Spacer(1, 0.4*inch))
-                        except Exception as e:
-                            logger.error(f"Error adding image for {scene}: {e}")
-            
-            # Scene text with enhanced decorative formatting
-            scene_text = story_data.get(scene, "")
-            if scene_text:
-                # Enhanced first letter effect with scene-specific styling
-                if len(scene_text) > 1:
-                    first_letter = scene_text[0].upper()
-                    rest_text = scene_text[1:]
-                    scene_color = ['#f97316', '#dc2626', '#374151', '#16a34a'][i]
-                    formatted_text = f"<font size='32' color='{scene_color}'><b>{first_letter}</b></font>{rest_text}"
-                    
-                    # Scene-specific story style
-                    scene_story_style = ParagraphStyle(
-                        f'SceneStory{i}',
-                        parent=story_style,
-                        backColor=colors_scheme[list(colors_scheme.keys())[i+1]]['bg'],
-                        borderWidth=2,
-                        borderColor=colors_scheme[list(colors_scheme.keys())[i+1]]['border'],
-                        borderRadius=10
-                    )
-                    
-                    story.append(Paragraph(formatted_text, scene_story_style))
-                else:
-                    story.append(Paragraph(scene_text, story_style))
-                
-                story.append(Spacer(1, 0.5*inch))
-            
-            # Add decorative separator except for last scene
-            if i < len(scenes) - 1:
-                separator_style = ParagraphStyle(
-                    'Separator',
-                    parent=styles['Normal'],
-                    fontSize=20,
-                    alignment=1,
-                    textColor=colors.HexColor('#f97316'),
-                    spaceAfter=30,
-                    spaceBefore=30
-                )
-                story.append(Paragraph("✨ ⭐ 🌟 ⭐ ✨", separator_style))
-                story.append(PageBreak())
-        
-        # === ENHANCED BACK PAGE ===
-        story.append(PageBreak())
-        story.append(Spacer(1, 1.5*inch))
-        
-        back_page_style = ParagraphStyle(
-            'BackPage',
-            parent=styles['Normal'],
-            fontSize=16,
-            alignment=1,
-            textColor=colors.HexColor('#2c5530'),
-            spaceAfter=25,
-            borderWidth=2,
-            borderColor=colors.HexColor('#f97316'),
-            borderPadding=15,
-            backColor=colors.HexColor('#f0f9f0'),
-            borderRadius=10
-        )
-        
-        story.append(Paragraph("🎉 ✨ Thank You for Reading! ✨ 🎉", title_style))
-        story.append(Spacer(1, 0.6*inch))
-        story.append(Paragraph("🌟 This magical story was lovingly created with EpicTales AI 🌟", back_page_style))
-        story.append(Paragraph("✨ Where imagination meets artificial intelligence ✨", back_page_style))
-        story.append(Spacer(1, 0.4*inch))
-        story.append(Paragraph("🚀 Ready for your next adventure? 🚀", back_page_style))
-        story.append(Paragraph("🌐 Visit: www.epictales-ai.com 🌐", brand_subtitle))
-        story.append(Spacer(1, 0.3*inch))
-        story.append(Paragraph("📚 Create • Imagine • Inspire 📚", back_page_style))
-        
-        # Build the PDF with custom page template
-        doc.build(story, onFirstPage=add_page_border, onLaterPages=add_page_border)
-        
-        logger.info(f"✅ Enhanced decorative PDF created successfully: {pdf_filename}")
-        return pdf_filename, None
-        
-    except Exception as e:
-        logger.error(f"❌ Error creating enhanced PDF: {e}")
-        return None, str(e)
+PDF_LAYOUT_VERSION = 1  # Bump when the layout changes so cached PDFs are rebuilt
+pdf_flight = SingleFlight()
+pdf_cache_stats = {"hits": 0, "misses": 0}
+pdf_cache_stats_lock = threading.Lock()
+
+def record_pdf_cache(counter):
+    with pdf_cache_stats_lock:
+        pdf_cache_stats[counter] += 1
+
+def get_pdf_cache_stats():
+    with pdf_cache_stats_lock:
+        stats = dict(pdf_cache_stats)
+    stats["files"] = len(os.listdir(PDF_CACHE_DIR))
+    return stats
+
+def resolve_static_image(image_url):
+    """Local path for a /static/ image URL, None if it isn't one we can read"""
+    if not image_url or not image_url.startswith('/static/'):
+        return None
+    path = safe_join("static", image_url[8:])
+    return path if path and os.path.isfile(path) else None
+
+def get_pdf_cache_key(story_data, images_data, story_options):
+    """Key a storybook on its text, options and the bytes of its images"""
+    image_hashes = {}
+    for scene in ["Introduction", "Rising Action", "Climax", "Resolution"]:
+        path = resolve_static_image(images_data.get(scene))
+        image_hashes[scene] = get_file_hash(path) if path else None
+    payload = json.dumps({
+        "version": PDF_LAYOUT_VERSION,
+        "image_settings": [PDF_IMAGE_DPI, PDF_JPEG_QUALITY],
+        "story": story_data,
+        "options": story_options,
+        "images": image_hashes
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+def get_cached_pdf(story_data, images_data, story_options):
+    """Return (pdf, error) - a cached file path, or a fresh render in memory
+
+    Nothing is written under static/, so the PDF is never publicly listed
+    and never has to be cleaned up after sending.
+    """
+    cache_key = get_pdf_cache_key(story_data, images_data, story_options)
+    pdf_path = os.path.join(PDF_CACHE_DIR, f"storybook_{cache_key}.pdf")
+    if os.path.exists(pdf_path):
+        os.utime(pdf_path)  # Bump recency for the LRU trim
+        record_pdf_cache("hits")
+        return os.path.abspath(pdf_path), None
+    
+    def render():
+        record_pdf_cache("misses")
+        data, error = render_pool.run(render_storybook_pdf, story_data, images_data, story_options)
+        if error:
+            return None, error
+        try:
+            write_chunks_atomic([data], pdf_path, max_bytes=None)
+            trim_pdf_cache()
+        except OSError as e:
+            logger.warning(f"⚠️ Could not cache PDF: {e}")  # Still serve it from memory
+        return data, None
+    
+    # Double clicks on the download button share one render
+    data, error = pdf_flight.do(cache_key, render)
+    return (io.BytesIO(data) if data is not None else None), error
 
 @app.route('/download-pdf', methods=['POST'])
 def download_pdf():
-    """Generate and download story as PDF with automatic cleanup"""
+    """Generate and download story as PDF, streamed from the cache or memory"""
     try:
         if not HAS_REPORTLAB:
             return jsonify({"error": "PDF generation not available"}), 500
@@ -1159,57 +2318,151 @@ def download_pdf():
         if not story_data:
             return jsonify({"error": "Story data required"}), 400
         
-        # Generate PDF
-        pdf_filename, error = create_storybook_pdf(story_data, images_data, story_options)
+        # Generate PDF (or reuse the cached render of this exact book)
+        pdf, error = get_cached_pdf(story_data, images_data, story_options)
         
         if error:
             return jsonify({"error": error}), 500
             
-        if not pdf_filename:
+        if pdf is None:
             return jsonify({"error": "Failed to create PDF"}), 500
         
-        # Return PDF file
-        pdf_path = os.path.join("static", pdf_filename)
-        
-        def remove_file_after_send(response):
-            """Remove PDF and image files after sending"""
-            try:
-                # Remove the PDF file
-                if os.path.exists(pdf_path):
-                    os.remove(pdf_path)
-                    logger.info(f"🗑️ Cleaned up PDF: {pdf_filename}")
-                
-                # Also cleanup associated image files if they exist
-                for scene in ["Introduction", "Rising Action", "Climax", "Resolution"]:
-                    if images_data.get(scene):
-                        image_url = images_data[scene]
-                        if image_url.startswith('/static/'):
-                            image_filename = image_url[8:]
-                            image_path = os.path.join("static", image_filename)
-                            if os.path.exists(image_path):
-                                os.remove(image_path)
-                                logger.info(f"🗑️ Cleaned up image: {image_filename}")
-                                
-            except Exception as e:
-                logger.error(f"Error during cleanup: {e}")
-            return response
-        
-        response = send_file(
-            pdf_path,
+        # Scene images stay in static/ - they are shared with the web page and other downloads
+        return send_file(
+            pdf,
             as_attachment=True,
             download_name=f"{story_data.get('title', 'My_Story').replace(' ', '_')}.pdf",
             mimetype='application/pdf'
         )
         
-        # Schedule cleanup after response is sent
-        response.call_on_close(lambda: remove_file_after_send(response))
-        
-        return response
-        
+    except PoolBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"PDF download error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# BATCH EXPORT - many storybooks rendered in parallel, streamed back as one ZIP
+BATCH_EXPORT_PARALLEL = max(RENDER_PROCESSES, 1)  # Books rendering at once per request
+pdf_batch_executor = ForkSafeExecutor(BATCH_EXPORT_PARALLEL * 2, "pdf-batch")
+
+class ZipStreamWriter:
+    """Unseekable sink for zipfile - the response drains it as entries are written"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def resolve_batch_books(data):
+    """Return ([(title, book)], errors) for the stories and job ids in a batch request"""
+    books = []
+    errors = []
+    for position, item in enumerate(data.get("stories") or [], 1):
+        if not isinstance(item, dict) or not isinstance(item.get("story"), dict):
+            errors.append({"story": position, "error": "Story data required"})
+            continue
+        books.append({"story": item["story"], "images": item.get("images") or {}, "options": item.get("options") or {}})
+    for job_id in data.get("job_ids") or []:
+        job = shared_cache.get(f"job:{job_id}")
+        if job is None or job.get("status") != "complete":
+            errors.append({"job_id": job_id, "error": "Job not found or not complete"})
+            continue
+        books.append({"story": job["story"], "images": job["images"], "options": job["options"]})
+    return books, errors
+
+def render_batch_book(book):
+    """Cached or freshly rendered PDF for one book, waiting out a busy render pool"""
+    deadline = time.time() + RENDER_TIMEOUT
+    while True:
+        try:
+            pdf, error = get_cached_pdf(book["story"], book["images"], book["options"])
+            break
+        except PoolBusyError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+    if error or pdf is None:
+        raise RuntimeError(error or "Failed to create PDF")
+    return pdf
+
+def batch_entry_name(index, story_data):
+    title = re.sub(r"[^A-Za-z0-9_-]+", "_", story_data.get("title", "My_Story")).strip("_")[:60]
+    return f"{index + 1:02d}_{title or 'story'}.pdf"
+
+def stream_pdf_zip(books, errors):
+    """Yield a ZIP of storybooks in completion order, holding only a few in memory"""
+    writer = ZipStreamWriter()
+    pending = {}
+    queue = iter(enumerate(books))
+    
+    def fill():
+        while len(pending) < BATCH_EXPORT_PARALLEL:
+            item = next(queue, None)
+            if item is None:
+                return
+            index, book = item
+            pending[pdf_batch_executor.submit(render_batch_book, book)] = index
+    
+    try:
+        # PDFs are already compressed, so entries are stored rather than deflated
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED) as archive:
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    story_data = books[index]["story"]
+                    try:
+                        pdf = future.result()
+                    except Exception as e:
+                        logger.error(f"Batch export failed for book {index + 1}: {e}")
+                        errors.append({"book": index + 1, "title": story_data.get("title"), "error": str(e)})
+                        continue
+                    
+                    source = open(pdf, "rb") if isinstance(pdf, str) else pdf
+                    with source, archive.open(batch_entry_name(index, story_data), "w") as entry:
+                        for chunk in iter(lambda: source.read(IMAGE_CHUNK_SIZE), b""):
+                            entry.write(chunk)
+                            yield writer.drain()
+                fill()
+            
+            if errors:
+                archive.writestr("errors.json", json.dumps(errors, indent=2))
+        yield writer.drain()
+    finally:
+        for future in pending:
+            future.cancel()
+
+@app.route('/download-pdf/batch', methods=['POST'])
+def download_pdf_batch():
+    """Render many storybooks in parallel and stream them back as a ZIP"""
+    if not HAS_REPORTLAB:
+        return jsonify({"error": "PDF generation not available"}), 500
+    if not request.is_json:
+        return jsonify({"error": "JSON required"}), 400
+    
+    books, errors = resolve_batch_books(request.json)
+    if not books:
+        return jsonify({"error": "No exportable stories", "details": errors}), 400
+    if len(books) > BATCH_EXPORT_MAX_BOOKS:
+        return jsonify({"error": f"At most {BATCH_EXPORT_MAX_BOOKS} stories per export"}), 400
+    
+    logger.info(f"📚 Batch export of {len(books)} storybooks")
+    response = Response(stream_pdf_zip(books, errors), mimetype="application/zip")
+    response.headers["Content-Disposition"] = "attachment; filename=storybooks.zip"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 if __name__ == "__main__":
     import os
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -1295,7 +2548,24 @@ def stats():
         "cache_stats": {
             "story_cache_size": len(story_cache),
             "image_cache_size": len(image_cache),
-            "max_cache_size": cache_max_size
+            "story_cache": story_cache.stats(),
+            "image_cache": image_cache.stats(),
+            "shared_cache_backend": shared_cache.name,
+            "shared_cache_entries": len(shared_cache),
+            "image_store": image_store.stats(),
+            "pdf_cache": get_pdf_cache_stats()
+        },
+        "upstream": get_upstream_stats(),
+        "model_health": model_health.snapshot(),
+        "single_flight": {
+            "generations": generation_flight.stats(),
+            "scene_images": scene_flight.stats(),
+            "pdfs": pdf_flight.stats()
+        },
+        "executors": {
+            "image": image_executor.stats(),
+            "jobs": job_executor.stats(),
+            "render": render_pool.stats()
         },
         "static_files": len([f for f in os.listdir('static') if f.endswith(('.png', '.jpg', '.jpeg', '.pdf'))]),
         "uptime_seconds": round(time.time() - process.create_time(), 2)
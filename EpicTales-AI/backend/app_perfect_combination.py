@@ -6,8 +6,20 @@ import time
 import requests
 import base64
 import io
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import json
+import hashlib
+import gc
+import importlib.util
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from render_worker import (
+    FALLBACK_COLOR_SCHEMES, FALLBACK_SCENE_ELEMENTS,
+    hex_to_rgb, load_font, gradient_background, save_image_atomic
+)
 
 # Import image generation from img.py approach
 try:
@@ -43,50 +55,528 @@ MODEL_CANDIDATES = [
 ]
 HTTP_TIMEOUT = 60
 
-def initialize_text_model():
-    """Initialize text generation model - FROM app_guaranteed.py (WORKING)"""
-    global text_gen
-    if text_gen is None:
+# TEXT GENERATION CONFIG
+MAX_PROMPT_CHARS = 400  # Limit prompt length to avoid token limits
+TEXT_BATCH_MAX = int(os.getenv('TEXT_BATCH_MAX', '16'))  # Prompts per forward pass
+TEXT_BATCH_WINDOW_MS = float(os.getenv('TEXT_BATCH_WINDOW_MS', '20'))  # How long a batch waits for more prompts
+TEXT_PREFIX_CACHE_MAX_BYTES = int(os.getenv('TEXT_PREFIX_CACHE_MAX_MB', '64')) * 1024 * 1024  # 0 disables
+TEXT_MODEL_PATH = os.getenv('TEXT_MODEL_PATH', 'gpt2')  # Hub id, or a local directory to load without network
+TEXT_MODEL_QUANTIZE = os.getenv('TEXT_MODEL_QUANTIZE', 'false').lower() == 'true'  # Dynamic int8 linear layers
+TEXT_QUANT_MIN_AGREEMENT = float(os.getenv('TEXT_QUANT_MIN_AGREEMENT', '0.9'))  # Top-1 match vs fp32 required
+QUANT_CHECK_TEXTS = [  # Probe prompts for the int8 vs fp32 agreement check
+    "Once upon a time, in a quiet village by the sea, a curious girl found a map that led to a hidden castle.",
+    "Write a magical story for children. Story concept: a dragon who is afraid of the dark. Introduction: ",
+    "The brave knight and his clever friend raced through the enchanted forest as the storm grew closer.",
+    "At the end of the adventure, everyone gathered in the town square to celebrate with music and cake.",
+]
+PRELOAD_TEXT_MODEL = os.getenv('PRELOAD_TEXT_MODEL', 'auto').lower()  # true | false | auto (only under gunicorn)
+PRELOAD_TEXT_MODEL = "gunicorn" in sys.modules if PRELOAD_TEXT_MODEL == 'auto' else PRELOAD_TEXT_MODEL == 'true'
+WEB_WORKERS = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))  # Gunicorn workers sharing this machine
+TEXT_MODEL_THREADS = int(os.getenv('TEXT_MODEL_THREADS', str(max(1, (os.cpu_count() or 1) // WEB_WORKERS))))  # Torch threads per worker
+TEXT_MODEL_PACKAGES = ("torch", "transformers")
+TEXT_GENERATE_OPTIONS = {"max_new_tokens": 80, "do_sample": True, "temperature": 0.8}
+
+text_model_lock = threading.Lock()
+text_model_state = {
+    "status": "not_loaded", "model": TEXT_MODEL_PATH, "precision": None,
+    "quantization_agreement": None, "load_seconds": None, "warmup_seconds": None, "error": None
+}
+
+def convert_conv1d_to_linear(model):
+    """Swap GPT-2's Conv1D projections for nn.Linear so dynamic quantization can see them
+
+    Returns the qualified names of the converted modules.
+    """
+    import torch.nn as nn
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        from transformers.modeling_utils import Conv1D
+    
+    converted = []
+    for parent_name, parent in list(model.named_modules()):
+        for child_name, child in list(parent.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            # Conv1D stores weight as (in, out), Linear as (out, in)
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(parent, child_name, linear)
+            converted.append(f"{parent_name}.{child_name}" if parent_name else child_name)
+    return converted
+
+def quantization_agreement(reference, quantized, tokenizer):
+    """Share of positions where the int8 and fp32 models predict the same next token
+
+    Counted over every token of all QUANT_CHECK_TEXTS, so one unusual
+    prompt cannot accept or reject the int8 model on its own.
+    """
+    import torch
+    matches = total = 0
+    with torch.no_grad():
+        for text in QUANT_CHECK_TEXTS:
+            input_ids = tokenizer(text, return_tensors="pt")["input_ids"]
+            expected = reference(input_ids).logits.argmax(-1)
+            actual = quantized(input_ids).logits.argmax(-1)
+            matches += (expected == actual).sum().item()
+            total += expected.numel()
+    return matches / total
+
+def quantize_text_model(model, tokenizer):
+    """Dynamic int8 copy of the transformer blocks, or None if it drifts too far from fp32
+
+    The LM head stays fp32 - it is tied to the embeddings and has the
+    largest effect on which word gets picked.
+    """
+    import copy
+    import torch
+    try:
+        from torch.ao.quantization import quantize_dynamic, default_dynamic_qconfig
+    except ImportError:
+        from torch.quantization import quantize_dynamic, default_dynamic_qconfig
+    
+    quantized = copy.deepcopy(model)
+    converted = convert_conv1d_to_linear(quantized)
+    quantized = quantize_dynamic(quantized, {name: default_dynamic_qconfig for name in converted}, dtype=torch.qint8)
+    quantized.eval()
+    
+    agreement = quantization_agreement(model, quantized, tokenizer)
+    text_model_state["quantization_agreement"] = round(agreement, 3)
+    if agreement < TEXT_QUANT_MIN_AGREEMENT:
+        logger.warning(f"⚠️ Int8 model agrees with fp32 on {agreement:.0%} of tokens, keeping fp32")
+        return None
+    logger.info(f"⚡ Int8 model ready ({len(converted)} layers quantized, {agreement:.0%} agreement with fp32)")
+    return quantized
+
+def missing_text_model_packages():
+    """Install hint for the packages the local text model needs, None when all are present"""
+    missing = [name for name in TEXT_MODEL_PACKAGES if importlib.util.find_spec(name) is None]
+    return f"{', '.join(missing)} not installed - run: pip install {' '.join(missing)}" if missing else None
+
+def load_text_pipeline():
+    """Build the text-generation pipeline from TEXT_MODEL_PATH, int8 when configured"""
+    from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+    
+    # A local directory never touches the network
+    local_only = os.path.isdir(TEXT_MODEL_PATH)
+    tokenizer = AutoTokenizer.from_pretrained(TEXT_MODEL_PATH, local_files_only=local_only)
+    model = AutoModelForCausalLM.from_pretrained(TEXT_MODEL_PATH, local_files_only=local_only)
+    model.eval()
+    
+    precision = "fp32"
+    if TEXT_MODEL_QUANTIZE:
         try:
-            logger.info("📖 Loading text generation model...")
-            from transformers import pipeline
-            import warnings
-            warnings.filterwarnings("ignore")
-            
-            text_gen = pipeline("text-generation", model="gpt2")
-            logger.info("✅ Text generation model loaded successfully")
+            quantized = quantize_text_model(model, tokenizer)
+            if quantized is not None:
+                model, precision = quantized, "int8"
         except Exception as e:
-            logger.error(f"❌ Failed to load text generation model: {e}")
+            logger.warning(f"⚠️ Int8 quantization failed, keeping fp32: {e}")
+    text_model_state["precision"] = precision
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+def initialize_text_model():
+    """Initialize text generation model once per process - FROM app_guaranteed.py (WORKING)"""
+    global text_gen
+    if text_gen is not None:
+        return text_gen
+    with text_model_lock:
+        if text_gen is None:  # Another thread may have loaded it while we waited
+            try:
+                missing = missing_text_model_packages()
+                if missing:
+                    raise ImportError(missing)
+                logger.info("📖 Loading text generation model...")
+                text_model_state["status"] = "loading"
+                start_time = time.time()
+                import warnings
+                warnings.filterwarnings("ignore")
+                
+                model = load_text_pipeline()
+                # Batched prompts are left-padded with EOS so generation continues from real tokens
+                model.tokenizer.pad_token_id = model.model.config.eos_token_id
+                model.tokenizer.padding_side = "left"
+                text_gen = model
+                text_model_state.update(status="loaded", load_seconds=round(time.time() - start_time, 2), error=None)
+                logger.info("✅ Text generation model loaded successfully")
+            except Exception as e:
+                text_model_state.update(status="failed", error=str(e))
+                logger.error(f"❌ Failed to load text generation model: {e}")
     return text_gen
 
-def generate_story_segment(prompt):
-    """Generate story text - FROM app_guaranteed.py (WORKING PERFECTLY)"""
+def warm_text_model():
+    """Load the model and run one short generation so the first request is fast"""
+    model = initialize_text_model()
+    if model is None:
+        return False
+    start_time = time.time()
     try:
-        model = initialize_text_model()
-        if model is None:
-            return "Text generation temporarily unavailable. Please try again later."
-        
-        # Limit prompt length to avoid token limits
-        if len(prompt) > 400:
-            prompt = prompt[:400]
-            
-        # Generate with better parameters
-        outputs = model(
-            prompt, 
-            max_new_tokens=80, 
-            do_sample=True, 
-            temperature=0.8,
-            pad_token_id=50256
-        )
-        generated_text = outputs[0]['generated_text']
+        model("Once upon a time", max_new_tokens=4, do_sample=False, pad_token_id=50256)
+    except Exception as e:
+        text_model_state.update(status="failed", error=f"warm-up failed: {e}")
+        logger.error(f"❌ Text model warm-up failed: {e}")
+        return False
+    text_model_state.update(status="ready", warmup_seconds=round(time.time() - start_time, 2))
+    logger.info(f"🔥 Text model warmed up in {text_model_state['warmup_seconds']}s")
+    return True
+
+def set_torch_threads(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+def preload_text_model():
+    """Load and warm the model in the gunicorn master so workers share it copy-on-write
+
+    Warm-up runs single-threaded: forking after torch has started its
+    OpenMP pool can hang the children. Workers raise the thread count
+    again in init_worker(). Objects alive at this point are frozen out
+    of the garbage collector so its scans don't copy their pages into
+    every worker.
+    """
+    set_torch_threads(1)
+    warm_text_model()
+    gc.collect()
+    gc.freeze()
+
+def init_worker():
+    """Per-worker setup after fork (called from gunicorn's post_worker_init)"""
+    set_torch_threads(TEXT_MODEL_THREADS)
+
+class PrefixKVCache:
+    """LRU of GPT-2 past key/values for shared prompt prefixes, bounded in bytes
+
+    Entries hold the prefix token ids and a legacy per-layer (key, value)
+    tuple of tensors shaped [1, heads, prefix_len, head_dim]. Prefixes
+    must end right before a space so tokenizing prefix and suffix
+    separately gives the same tokens as tokenizing the whole prompt.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # prefix -> (token_ids, past, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, lm, tokenizer, prefix):
+        with self._lock:
+            entry = self._data.get(prefix)
+            if entry is not None:
+                self._data.move_to_end(prefix)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
         
-        # Extract only the newly generated part
-        new_text = generated_text[len(prompt):].strip()
-        return new_text if new_text else "Story generation completed."
+        import torch
+        token_ids = tokenizer(prefix)["input_ids"]
+        with torch.no_grad():
+            past = lm(input_ids=torch.tensor([token_ids]), use_cache=True).past_key_values
+        if hasattr(past, "layers"):  # transformers 5.x Cache
+            past = [(layer.keys, layer.values) for layer in past.layers]
+        elif hasattr(past, "to_legacy_cache"):
+            past = past.to_legacy_cache()
+        past = tuple((key, value) for key, value, *_ in past)
+        size = sum(t.element_size() * t.nelement() for layer in past for t in layer)
         
+        with self._lock:
+            if size <= self.max_bytes and prefix not in self._data:
+                self._data[prefix] = (token_ids, past, size)
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    _, (_, _, evicted) = self._data.popitem(last=False)
+                    self.current_bytes -= evicted
+                    self.evictions += 1
+        return token_ids, past
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+prefix_cache = PrefixKVCache(TEXT_PREFIX_CACHE_MAX_BYTES)
+prefix_cache_enabled = TEXT_PREFIX_CACHE_MAX_BYTES > 0
+
+def prefix_cache_supported():
+    """generate() only skips already-cached input tokens from transformers 4.38 on"""
+    try:
+        import transformers
+        from packaging import version
+        return version.parse(transformers.__version__) >= version.parse("4.38")
+    except Exception:
+        return False
+
+def prefix_past_for_model(lm, legacy):
+    """The cached prefix in the form this model's generate() accepts
+
+    Models that predate Cache classes (GPT-2 on transformers 4.x sets
+    _supports_cache_class = False) reject a DynamicCache and take the
+    legacy tuple. transformers 5.x dropped the flag and the tuple, and
+    only takes a Cache.
+    """
+    if not getattr(lm, "_supports_cache_class", True):
+        return legacy
+    from transformers import DynamicCache
+    cache = DynamicCache()
+    for layer, (key, value) in enumerate(legacy):
+        cache.update(key, value, layer)
+    return cache
+
+def generate_with_prefix_cache(pipe, items, **options):
+    """Batched generation for (prefix, suffix) prompts reusing cached prefix key/values
+
+    Each row is laid out as [left pad][prefix][middle pad][suffix]. The
+    cached prefix key/values are left-padded to the longest prefix, and
+    the suffixes (with their middle padding) are the only prompt tokens
+    the model still has to encode. Padding is masked out, and GPT-2
+    derives position ids from the mask, so every prefix keeps the
+    positions it was cached with. options override TEXT_GENERATE_OPTIONS.
+    """
+    import torch
+    import torch.nn.functional as F
+    tokenizer, lm = pipe.tokenizer, pipe.model
+    pad_id = tokenizer.pad_token_id
+    
+    rows = []
+    for prefix, suffix in items:
+        token_ids, past = prefix_cache.get_or_build(lm, tokenizer, prefix) if prefix else ([], None)
+        rows.append((token_ids, past, tokenizer(suffix)["input_ids"]))
+    max_prefix = max(len(token_ids) for token_ids, _, _ in rows)
+    max_suffix = max(len(suffix_ids) for _, _, suffix_ids in rows)
+    
+    input_ids, attention_mask = [], []
+    for token_ids, _, suffix_ids in rows:
+        left, middle = max_prefix - len(token_ids), max_suffix - len(suffix_ids)
+        input_ids.append([pad_id] * left + token_ids + [pad_id] * middle + suffix_ids)
+        attention_mask.append([0] * left + [1] * len(token_ids) + [0] * middle + [1] * len(suffix_ids))
+    
+    past_key_values = None
+    if max_prefix:
+        # Any cached prefix gives us the per-layer tensor shapes for rows without one
+        template = next(past for _, past, _ in rows if past is not None)
+        layers = []
+        for layer, (template_key, template_value) in enumerate(template):
+            keys, values = [], []
+            for token_ids, past, _ in rows:
+                if past is None:
+                    shape = (1, template_key.shape[1], max_prefix, template_key.shape[3])
+                    keys.append(template_key.new_zeros(shape))
+                    values.append(template_value.new_zeros(shape))
+                    continue
+                left = max_prefix - len(token_ids)
+                keys.append(F.pad(past[layer][0], (0, 0, left, 0)))
+                values.append(F.pad(past[layer][1], (0, 0, left, 0)))
+            layers.append((torch.cat(keys), torch.cat(values)))
+        past_key_values = prefix_past_for_model(lm, tuple(layers))
+    
+    with torch.no_grad():
+        output = lm.generate(
+            input_ids=torch.tensor(input_ids),
+            attention_mask=torch.tensor(attention_mask),
+            past_key_values=past_key_values,
+            pad_token_id=pad_id,
+            **dict(TEXT_GENERATE_OPTIONS, **options)
+        )
+    return [text.strip() for text in tokenizer.batch_decode(output[:, len(input_ids[0]):], skip_special_tokens=True)]
+
+def run_text_batch(prompts):
+    """One padded forward pass for a list of (prefix, suffix) prompts, returns the new text of each"""
+    global prefix_cache_enabled
+    model = initialize_text_model()
+    if model is None:
+        return ["Text generation temporarily unavailable. Please try again later."] * len(prompts)
+    
+    if prefix_cache_enabled and prefix_cache_supported():
+        try:
+            texts = generate_with_prefix_cache(model, prompts)
+            return [text if text else "Story generation completed." for text in texts]
+        except (TypeError, ValueError, AttributeError, ImportError) as e:
+            # This transformers version does not take the cache the way we pass it
+            # (generate() reports an unsupported past_key_values as ValueError)
+            prefix_cache_enabled = False
+            logger.warning(f"⚠️ Prefix KV cache disabled, generating without it: {e}")
+        except Exception as e:
+            logger.warning(f"⚠️ Prefix KV cache failed for this batch, generating without it: {e}")
+    
+    # Generate with better parameters
+    full_prompts = [prefix + suffix for prefix, suffix in prompts]
+    outputs = model(
+        full_prompts,
+        batch_size=len(full_prompts),
+        pad_token_id=50256,
+        **TEXT_GENERATE_OPTIONS
+    )
+    
+    # Extract only the newly generated part of each prompt
+    texts = []
+    for prompt, output in zip(full_prompts, outputs):
+        new_text = output[0]['generated_text'][len(prompt):].strip()
+        texts.append(new_text if new_text else "Story generation completed.")
+    return texts
+
+class Histogram:
+    """Fixed-bucket histogram for /stats"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket is overflow
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "mean": round(self.total / self.count, 2) if self.count else 0.0
+        }
+
+class TextBatchScheduler:
+    """Micro-batching for text generation across concurrent requests
+
+    Callers queue their prompts and wait on a future. A scheduler thread
+    takes the oldest request, waits up to window_ms for more to arrive
+    (or until max_batch prompts are queued), runs them all as one batch
+    and resolves each caller's future with its slice of the results.
+    A longer window gives bigger batches at the cost of added latency.
+    The thread is started lazily per process, so it survives gunicorn's fork.
+    """
+
+    def __init__(self, max_batch, window_ms):
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self._queue = deque()  # (prompts, future, enqueued_at)
+        self._queued_prompts = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.prompts = 0
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_wait_ms = Histogram([1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000])
+
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._thread = threading.Thread(target=self._run, name="text-batcher", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def submit(self, prompts):
+        future = Future()
+        with self._cond:
+            self._ensure_thread()
+            self._queue.append((prompts, future, time.time()))
+            self._queued_prompts += len(prompts)
+            self._cond.notify()
+        return future
+
+    def generate(self, prompts):
+        return self.submit(prompts).result()
+
+    def _take_batch(self):
+        """Wait out the batching window, then pop up to max_batch prompts worth of requests"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0][2] + self.window
+            while self._queued_prompts < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            
+            batch = []
+            taken = 0
+            while self._queue and (not batch or taken + len(self._queue[0][0]) <= self.max_batch):
+                entry = self._queue.popleft()
+                taken += len(entry[0])
+                batch.append(entry)
+            self._queued_prompts -= taken
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            started = time.time()
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            flat = [prompt for prompts, _, _ in batch for prompt in prompts]
+            with self._cond:
+                self.batches += 1
+                self.prompts += len(flat)
+                self.batch_sizes.record(len(flat))
+                for _, _, enqueued_at in batch:
+                    self.queue_wait_ms.record((started - enqueued_at) * 1000)
+            try:
+                texts = run_text_batch(flat)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for prompts, future, _ in batch:
+                future.set_result(texts[offset:offset + len(prompts)])
+                offset += len(prompts)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_batch": self.max_batch,
+                "window_ms": self.window * 1000,
+                "queued_requests": len(self._queue),
+                "batches": self.batches,
+                "prompts": self.prompts,
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_wait_ms": self.queue_wait_ms.snapshot()
+            }
+
+text_scheduler = TextBatchScheduler(TEXT_BATCH_MAX, TEXT_BATCH_WINDOW_MS)
+
+def split_prompt(prompt):
+    """(prefix, suffix) for the KV cache - plain strings have no cacheable prefix"""
+    prefix, suffix = prompt if isinstance(prompt, tuple) else ("", prompt)
+    if len(prefix) >= MAX_PROMPT_CHARS:
+        return "", (prefix + suffix)[:MAX_PROMPT_CHARS]
+    return prefix, suffix[:MAX_PROMPT_CHARS - len(prefix)]
+
+def generate_story_segments(prompts):
+    """Generate story text for several prompts in one batched pass
+
+    A prompt is a string or a (prefix, suffix) tuple whose prefix is
+    shared with other prompts and can be served from the KV cache.
+    """
+    prompts = [split_prompt(prompt) for prompt in prompts]
+    try:
+        return text_scheduler.generate(prompts)
     except Exception as e:
-        logger.error(f"Error generating story segment: {e}")
-        return f"Story generation error: {str(e)}"
+        logger.error(f"Error generating story segments: {e}")
+        return [f"Story generation error: {str(e)}"] * len(prompts)
+
+def generate_story_segment(prompt):
+    """Generate story text - FROM app_guaranteed.py (WORKING PERFECTLY)"""
+    return generate_story_segments([prompt])[0]
 
 def sanitize_filename(model_id):
     """Helper for filename from img.py"""
@@ -208,54 +698,37 @@ def generate_real_image_huggingface(prompt, scene_name, art_style="cartoon"):
     logger.error(f"❌ All Hugging Face models failed for {scene_name}")
     return None
 
+# FALLBACK RENDERING - backgrounds, fonts and finished images are all cached
+# (the colour schemes and drawing helpers are shared with app.py's render_worker)
+FALLBACK_SIZE = 768
+
 def create_fallback_image(scene_name, story_text, art_style):
     """Create beautiful fallback image when API fails"""
     try:
-        logger.info(f"🎨 Creating fallback image for {scene_name}...")
-        
-        # Create high-quality fallback
-        img = Image.new('RGB', (768, 768), color='#1a1a2e')
-        draw = ImageDraw.Draw(img)
+        preview = story_text[:80] + "..." if len(story_text) > 80 else story_text
         
-        # Art style color schemes
-        color_schemes = {
-            "cartoon": {"bg": "#ff6b6b", "accent": "#4ecdc4", "text": "#ffffff"},
-            "realistic": {"bg": "#2c3e50", "accent": "#3498db", "text": "#ecf0f1"},
-            "anime": {"bg": "#8e44ad", "accent": "#f39c12", "text": "#ffffff"},
-            "watercolor": {"bg": "#74b9ff", "accent": "#fd79a8", "text": "#2d3436"},
-            "default": {"bg": "#4a5568", "accent": "#ed8936", "text": "#f7fafc"}
-        }
-        
-        colors = color_schemes.get(art_style, color_schemes["default"])
+        # Same scene, style and text always render the same image - reuse it
+        digest = hashlib.md5(f"{scene_name}\x1f{art_style}\x1f{preview}".encode()).hexdigest()[:16]
+        img_filename = f"fallback_{scene_name.lower().replace(' ', '_')}_{digest}.png"
+        img_path = os.path.join("static", img_filename)
+        if os.path.exists(img_path):
+            logger.info(f"💾 Reusing fallback image: {img_filename}")
+            return img_filename
         
-        # Create gradient background
-        bg_rgb = tuple(int(colors["bg"][i:i+2], 16) for i in (1, 3, 5))
-        accent_rgb = tuple(int(colors["accent"][i:i+2], 16) for i in (1, 3, 5))
+        logger.info(f"🎨 Creating fallback image for {scene_name}...")
         
-        for y in range(768):
-            blend = y / 768
-            r = int(bg_rgb[0] * (1-blend) + accent_rgb[0] * blend)
-            g = int(bg_rgb[1] * (1-blend) + accent_rgb[1] * blend)
-            b = int(bg_rgb[2] * (1-blend) + accent_rgb[2] * blend)
-            draw.line([(0, y), (768, y)], fill=(r, g, b))
+        # Art style color scheme over a cached gradient background
+        colors = FALLBACK_COLOR_SCHEMES.get(art_style, FALLBACK_COLOR_SCHEMES["default"])
+        accent_rgb = hex_to_rgb(colors["accent"])
+        img = gradient_background(hex_to_rgb(colors["bg"]), accent_rgb, FALLBACK_SIZE).copy()
+        draw = ImageDraw.Draw(img)
         
         # Add decorative elements
-        scene_elements = {
-            "Introduction": "✨ 🏰 ✨",
-            "Rising Action": "⚡ 🗡️ ⚡", 
-            "Climax": "💥 ⭐ 💥",
-            "Resolution": "🌟 👑 🌟"
-        }
-        
-        decoration = scene_elements.get(scene_name, "🎨 ✨ 🎨")
+        decoration = FALLBACK_SCENE_ELEMENTS.get(scene_name, "🎨 ✨ 🎨")
         
-        # Load fonts
-        try:
-            title_font = ImageFont.truetype("arial.ttf", 48)
-            text_font = ImageFont.truetype("arial.ttf", 20)
-        except:
-            title_font = ImageFont.load_default()
-            text_font = ImageFont.load_default()
+        # Fonts are resolved once per process
+        title_font = load_font(48)
+        text_font = load_font(20)
         
         # Add text content
         lines = [
@@ -267,7 +740,7 @@ def create_fallback_image(scene_name, story_text, art_style):
             "API Temporarily Busy",
             "",
             "📖 Story Preview:",
-            story_text[:80] + "..." if len(story_text) > 80 else story_text,
+            preview,
             "",
             f"🎭 Style: {art_style.title()}",
             "✨ Real images will load next time"
@@ -282,7 +755,7 @@ def create_fallback_image(scene_name, story_text, art_style):
                 # Center text
                 bbox = draw.textbbox((0, 0), line, font=font)
                 text_width = bbox[2] - bbox[0]
-                x_pos = (768 - text_width) // 2
+                x_pos = (FALLBACK_SIZE - text_width) // 2
                 
                 # Add shadow
                 draw.text((x_pos + 2, y_pos + 2), line, fill=(0, 0, 0, 128), font=font)
@@ -291,10 +764,7 @@ def create_fallback_image(scene_name, story_text, art_style):
             y_pos += 45 if i in [0, 2] else 30
         
         # Save fallback image
-        timestamp = int(time.time())
-        img_filename = f"fallback_{scene_name.lower().replace(' ', '_')}_{timestamp}.png"
-        img_path = os.path.join("static", img_filename)
-        img.save(img_path, "PNG", quality=95)
+        save_image_atomic(img, img_path)
         
         logger.info(f"✅ Created fallback image: {img_filename}")
         return img_filename
@@ -334,10 +804,7 @@ def generate_image_perfect_combination(prompt, scene_name, art_style="cartoon"):
         
         text = f"{scene_name}\n\nImage generation\ntemporarily unavailable"
         
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            font = ImageFont.load_default()
+        font = load_font(24)
         
         # Center text
         lines = text.split('\n')
@@ -390,21 +857,26 @@ def generate():
         logger.info(f"📖 Story generation: app_guaranteed.py method")
         logger.info(f"🎨 Image generation: img.py method (Hugging Face API)")
 
+        # Story generation using app_guaranteed.py method - all four scenes in one batch
+        scene_context = {
+            "Introduction": "Begin the story by introducing the main character and setting",
+            "Rising Action": "Develop the conflict and build tension",
+            "Climax": "Reach the most exciting or turning point of the story", 
+            "Resolution": "Conclude the story and resolve the conflict"
+        }
+        # Everything up to "Story concept:" repeats across requests - its KV is cached
+        prompts = [
+            (f"{scene_context[scene]} for a {genre} story with a {tone} tone suitable for {audience}. Story concept:",
+             f" {story_idea}. {scene}: ")
+            for scene in scenes
+        ]
+        logger.info(f"📖 Generating story for {len(scenes)} scenes in one batch...")
+        texts = generate_story_segments(prompts)
+
         # Generate content for each scene
         for i, scene in enumerate(scenes):
             try:
-                # Story generation using app_guaranteed.py method (WORKING)
-                scene_context = {
-                    "Introduction": "Begin the story by introducing the main character and setting",
-                    "Rising Action": "Develop the conflict and build tension",
-                    "Climax": "Reach the most exciting or turning point of the story", 
-                    "Resolution": "Conclude the story and resolve the conflict"
-                }
-                
-                prompt = f"{scene_context[scene]} for a {genre} story with a {tone} tone suitable for {audience}. Story concept: {story_idea}. {scene}: "
-                
-                logger.info(f"📖 Generating story for {scene} ({i+1}/4)...")
-                text = generate_story_segment(prompt)
+                text = texts[i]
                 story[scene] = text
 
                 # Image generation using img.py method (WORKING)
@@ -474,6 +946,28 @@ def health_check():
         "note": "Best of both worlds: Working stories + Working images"
     })
 
+@app.route('/ready', methods=['GET'])
+def ready_check():
+    """Readiness probe - 200 once the text model is loaded and warmed up"""
+    state = dict(text_model_state, pid=os.getpid())
+    missing = missing_text_model_packages()
+    if missing:
+        state.update(ready=False, error=missing)
+    elif PRELOAD_TEXT_MODEL:
+        state["ready"] = text_model_state["status"] == "ready"
+    else:
+        state["ready"] = text_model_state["status"] != "failed"  # Loads on first request
+    return jsonify(state), (200 if state["ready"] else 503)
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Text model state and micro-batching statistics"""
+    return jsonify({
+        "text_model": text_model_state,
+        "text_batching": text_scheduler.stats(),
+        "prefix_kv_cache": dict(prefix_cache.stats(), enabled=prefix_cache_enabled)
+    })
+
 @app.route('/test', methods=['GET'])
 def test_endpoint():
     """Simple test endpoint"""
@@ -485,7 +979,14 @@ def test_endpoint():
         "combination": "perfect"
     })
 
+# Load the model before gunicorn forks its workers (preload_app = True).
+# Plain imports and the debug server load it lazily on the first request.
+if PRELOAD_TEXT_MODEL:
+    preload_text_model()
+
 if __name__ == "__main__":
+    init_worker()
+    
     # Change to the script's directory to ensure static files work
     import os
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -9,7 +9,8 @@ bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
 backlog = 2048
 
 # Worker processes
-workers = min(4, (multiprocessing.cpu_count() * 2) + 1)
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(4, (multiprocessing.cpu_count() * 2) + 1))))
+os.environ['WEB_CONCURRENCY'] = str(workers)  # The app sizes its per-worker process pools from this
 worker_class = "sync"
 worker_connections = 1000
 max_requests = 1000
@@ -57,6 +58,14 @@ def post_fork(server, worker):
     """Called just after a worker has been forked."""
     worker.log.info("Worker spawned (pid: %s)", worker.pid)
 
+def post_worker_init(worker):
+    """Called after the worker has loaded the app - per-worker pools and model threads."""
+    import sys
+    for name in ("app", "app_perfect_combination"):
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, "init_worker"):
+            module.init_worker()
+
 def worker_abort(worker):
     """Called when a worker process is killed by a signal."""
     worker.log.info("Worker aborted (pid: %s)", worker.pid)
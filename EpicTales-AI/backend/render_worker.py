@@ -0,0 +1,560 @@
+"""Image and PDF rendering run by the render process pool
+
+Render processes are spawned and import only this module, so it must stay
+free of the web app's import-time work - no Flask app, shared cache, image
+store scan or log handlers. Everything here is also safe to call inline
+from a web worker.
+"""
+
+import functools
+import hashlib
+import io
+import logging
+import os
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+from caches import LRUCache
+
+# PDF generation imports
+try:
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, PageBreak
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    HAS_REPORTLAB = True
+except ImportError:
+    HAS_REPORTLAB = False
+
+# Optional NumPy for vectorized fallback rendering
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+logger = logging.getLogger(__name__)
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+# FALLBACK RENDERING - backgrounds, fonts and finished images are all cached
+FALLBACK_SIZE = 512
+
+FALLBACK_COLOR_SCHEMES = {
+    "cartoon": {"bg": "#ff6b6b", "accent": "#4ecdc4", "text": "#ffffff"},
+    "realistic": {"bg": "#2c3e50", "accent": "#3498db", "text": "#ecf0f1"},
+    "anime": {"bg": "#8e44ad", "accent": "#f39c12", "text": "#ffffff"},
+    "watercolor": {"bg": "#74b9ff", "accent": "#fd79a8", "text": "#2d3436"},
+    "default": {"bg": "#4a5568", "accent": "#ed8936", "text": "#f7fafc"}
+}
+
+FALLBACK_SCENE_ELEMENTS = {
+    "Introduction": "✨ 🏰 ✨",
+    "Rising Action": "⚡ 🗡️ ⚡", 
+    "Climax": "💥 ⭐ 💥",
+    "Resolution": "🌟 👑 🌟"
+}
+
+# Tried in order; "arial.ttf" only resolves on Windows/macOS
+FONT_CANDIDATES = [
+    "arial.ttf",
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"
+]
+
+def hex_to_rgb(color):
+    return tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    """Resolve a TrueType font once per process and size, default bitmap font otherwise"""
+    for candidate in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    logger.warning(f"⚠️ No TrueType font found, using default font for size {size}")
+    return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=16)
+def gradient_background(top_rgb, bottom_rgb, size):
+    """Vertical gradient built in one array operation, cached per colour scheme
+
+    The returned image is shared - callers must copy() it before drawing.
+    """
+    if HAS_NUMPY:
+        blend = (np.arange(size, dtype=np.float32) / size)[:, None]
+        column = np.array(top_rgb, dtype=np.float32) * (1 - blend) + np.array(bottom_rgb, dtype=np.float32) * blend
+        pixels = np.broadcast_to(column.astype(np.uint8)[:, None, :], (size, size, 3))
+        return Image.fromarray(np.ascontiguousarray(pixels), "RGB")
+    
+    # Pillow only: build a 1-pixel column and stretch it
+    column = Image.new("RGB", (1, size))
+    column.putdata([
+        tuple(int(top_rgb[c] * (1 - y / size) + bottom_rgb[c] * (y / size)) for c in range(3))
+        for y in range(size)
+    ])
+    return column.resize((size, size), Image.NEAREST)
+
+def save_image_atomic(img, img_path, fmt="PNG", **save_options):
+    """Write to a temp file and rename, so readers never see a half-written image"""
+    tmp_path = f"{img_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        img.save(tmp_path, fmt, **save_options)
+        os.replace(tmp_path, img_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def render_fallback_image(scene_name, preview, art_style, img_path):
+    """Draw a fallback card and save it - runs in a render process"""
+    # Art style color scheme over a cached gradient background
+    colors = FALLBACK_COLOR_SCHEMES.get(art_style, FALLBACK_COLOR_SCHEMES["default"])
+    accent_rgb = hex_to_rgb(colors["accent"])
+    img = gradient_background(hex_to_rgb(colors["bg"]), accent_rgb, FALLBACK_SIZE).copy()
+    draw = ImageDraw.Draw(img)
+    
+    # Add decorative elements
+    decoration = FALLBACK_SCENE_ELEMENTS.get(scene_name, "🎨 ✨ 🎨")
+    
+    # Fonts are resolved once per process
+    title_font = load_font(32)
+    text_font = load_font(16)
+    
+    # Add text content
+    lines = [
+        decoration,
+        "",
+        scene_name.upper(),
+        "",
+        "🎨 AI Image Loading...", 
+        "Real images coming soon",
+        "",
+        "📖 Story Preview:",
+        preview,
+        "",
+        f"🎭 Style: {art_style.title()}",
+        "✨ Please wait..."
+    ]
+    
+    y_pos = 80
+    for i, line in enumerate(lines):
+        if line:
+            font = title_font if i in [0, 2] else text_font
+            color = accent_rgb if i in [0, 2] else (255, 255, 255)
+            
+            # Center text
+            bbox = draw.textbbox((0, 0), line, font=font)
+            text_width = bbox[2] - bbox[0]
+            x_pos = (FALLBACK_SIZE - text_width) // 2
+            
+            # Add shadow
+            draw.text((x_pos + 1, y_pos + 1), line, fill=(0, 0, 0, 128), font=font)
+            draw.text((x_pos, y_pos), line, fill=color, font=font)
+        
+        y_pos += 35 if i in [0, 2] else 25
+    
+    # Save fallback image
+    save_image_atomic(img, img_path)
+    return img_path
+
+# PDF RENDERING - images are resampled for print and cached by content
+PDF_IMAGE_DPI = int(os.getenv('PDF_IMAGE_DPI', '150'))  # Resolution of images at their placed size
+PDF_JPEG_QUALITY = int(os.getenv('PDF_JPEG_QUALITY', '80'))
+PDF_IMAGE_CACHE_MAX_BYTES = int(os.getenv('PDF_IMAGE_CACHE_MAX_MB', '32')) * 1024 * 1024
+pdf_images = LRUCache(PDF_IMAGE_CACHE_MAX_BYTES)  # (content hash, size, dpi, quality) -> JPEG bytes
+file_hashes = LRUCache(1024 * 1024)  # (path, mtime, size) -> sha256 of contents
+
+def get_file_hash(path):
+    """Content hash of a file, memoized on its mtime and size"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    digest = file_hashes.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        file_hashes.set(key, digest)
+    return digest
+
+def prepare_pdf_image(path, width, height):
+    """JPEG bytes of an image resampled for its placed size (in points) at PDF_IMAGE_DPI
+
+    ReportLab embeds whatever it is given losslessly, so full-size PNGs
+    make large, slow PDFs. Prepared bytes are cached by content hash.
+    """
+    target = (round(width / inch * PDF_IMAGE_DPI), round(height / inch * PDF_IMAGE_DPI))
+    key = (get_file_hash(path), target, PDF_JPEG_QUALITY)
+    data = pdf_images.get(key)
+    if data is not None:
+        return data
+    
+    with Image.open(path) as img:
+        img.draft("RGB", target)  # Lets JPEG sources decode at reduced size
+        img.load()
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        # Never upscale - the PDF viewer stretches small images just as well
+        size = (min(target[0], img.width), min(target[1], img.height))
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=PDF_JPEG_QUALITY, optimize=True)
+    data = buffer.getvalue()
+    pdf_images.set(key, data)
+    return data
+
+def pdf_image(path, width, height):
+    """Flowable for a scene image, prepared for print instead of embedded at full size"""
+    return RLImage(io.BytesIO(prepare_pdf_image(path, width, height)), width=width, height=height)
+
+def render_storybook_pdf(story_data, images_data, story_options):
+    """Render a storybook to (pdf_bytes, error) - runs in a render process"""
+    buffer = io.BytesIO()
+    _, error = create_storybook_pdf(story_data, images_data, story_options, buffer)
+    return (None, error) if error else (buffer.getvalue(), None)
+
+def create_storybook_pdf(story_data, images_data, story_options, output):
+    """Create a beautiful, branded storybook PDF with decorative elements and page borders
+
+    output is a path or a writable binary file object.
+    """
+    try:
+        if not HAS_REPORTLAB:
+            return None, "PDF generation not available - reportlab not installed"
+        
+        
+        # Custom page template with decorative borders
+        def add_page_border(canvas, doc):
+            """Add decorative border to each page"""
+            # Page dimensions
+            width, height = A4
+            margin = 30
+            
+            # Set line width for border
+            canvas.setLineWidth(3)
+            
+            # Outer decorative border (thick)
+            canvas.setStrokeColor(colors.HexColor('#f97316'))  # Orange
+            canvas.rect(margin, margin, width - 2*margin, height - 2*margin, fill=0, stroke=1)
+            
+            # Inner decorative border (thin)
+            canvas.setLineWidth(1)
+            canvas.setStrokeColor(colors.HexColor('#2c5530'))  # Green
+            canvas.rect(margin + 15, margin + 15, width - 2*(margin + 15), height - 2*(margin + 15), fill=0, stroke=1)
+            
+            # Corner decorations
+            corner_size = 20
+            corners = [
+                (margin + 5, height - margin - 5),  # Top left
+                (width - margin - 5, height - margin - 5),  # Top right
+                (margin + 5, margin + 5),  # Bottom left
+                (width - margin - 5, margin + 5),  # Bottom right
+            ]
+            
+            canvas.setFillColor(colors.HexColor('#f97316'))
+            for x, y in corners:
+                canvas.circle(x, y, 8, fill=1, stroke=0)
+                canvas.setFillColor(colors.HexColor('#2c5530'))
+                canvas.circle(x, y, 4, fill=1, stroke=0)
+                canvas.setFillColor(colors.HexColor('#f97316'))
+        
+        # Create the PDF document with custom template
+        doc = SimpleDocTemplate(output, pagesize=A4, 
+                              leftMargin=1*inch, rightMargin=1*inch,
+                              topMargin=1*inch, bottomMargin=1*inch)
+        
+        # Get styles and create custom ones
+        styles = getSampleStyleSheet()
+        story = []
+        
+        # Brand colors for different page types
+        colors_scheme = {
+            'cover': {'bg': colors.HexColor('#f0f9f0'), 'border': colors.HexColor('#2c5530')},
+            'introduction': {'bg': colors.HexColor('#fff7ed'), 'border': colors.HexColor('#f97316')},
+            'rising_action': {'bg': colors.HexColor('#fef3f2'), 'border': colors.HexColor('#dc2626')},
+            'climax': {'bg': colors.HexColor('#f3f4f6'), 'border': colors.HexColor('#374151')},
+            'resolution': {'bg': colors.HexColor('#f0fdf4'), 'border': colors.HexColor('#16a34a')}
+        }
+        
+        # Enhanced decorative styles
+        title_style = ParagraphStyle(
+            'BrandTitle',
+            parent=styles['Heading1'],
+            fontSize=36,
+            spaceAfter=50,
+            spaceBefore=30,
+            alignment=1,  # Center
+            textColor=colors.HexColor('#2c5530'),
+            fontName='Helvetica-Bold',
+            borderWidth=4,
+            borderColor=colors.HexColor('#f97316'),
+            borderPadding=20,
+            backColor=colors.HexColor('#f0f9f0'),
+            borderRadius=15
+        )
+        
+        brand_subtitle = ParagraphStyle(
+            'BrandSubtitle',
+            parent=styles['Heading2'],
+            fontSize=20,
+            spaceAfter=25,
+            spaceBefore=15,
+            alignment=1,
+            textColor=colors.HexColor('#f97316'),
+            fontName='Helvetica-Bold'
+        )
+        
+        chapter_style = ParagraphStyle(
+            'DecorativeChapter',
+            parent=styles['Heading2'], 
+            fontSize=26,
+            spaceAfter=25,
+            spaceBefore=35,
+            alignment=1,
+            textColor=colors.HexColor('#2c5530'),
+            fontName='Helvetica-Bold',
+            borderWidth=3,
+            borderColor=colors.HexColor('#f97316'),
+            borderPadding=15,
+            backColor=colors.HexColor('#fff7ed'),
+            leftIndent=40,
+            rightIndent=40,
+            borderRadius=12
+        )
+        
+        story_style = ParagraphStyle(
+            'StoryText',
+            parent=styles['Normal'],
+            fontSize=16,
+            spaceAfter=25,
+            spaceBefore=15,
+            leftIndent=40,
+            rightIndent=40,
+            leading=24,
+            fontName='Helvetica',
+            textColor=colors.HexColor('#1f2937'),
+            backColor=colors.HexColor('#fefefe'),
+            borderPadding=15
+        )
+        
+        info_style = ParagraphStyle(
+            'InfoText',
+            parent=styles['Normal'],
+            fontSize=13,
+            spaceAfter=20,
+            leftIndent=30,
+            rightIndent=30,
+            textColor=colors.HexColor('#6b7280'),
+            backColor=colors.HexColor('#f8fafc'),
+            borderWidth=2,
+            borderColor=colors.HexColor('#e2e8f0'),
+            borderPadding=15,
+            borderRadius=10
+        )
+        
+        # === COVER PAGE ===
+        # Brand header with decorative elements
+        story.append(Paragraph("✨📚 EpicTales AI 📚✨", brand_subtitle))
+        story.append(Spacer(1, 0.4*inch))
+        
+        # Main title with enhanced decoration
+        title_text = story_data.get('title', 'My Epic Story')
+        story.append(Paragraph(f"🌟 {title_text} 🌟", title_style))
+        story.append(Spacer(1, 0.5*inch))
+        
+        # Story information with enhanced formatting
+        characters_text = ", ".join(story_options.get('characters', [])) if story_options.get('characters') else "Various Characters"
+        
+        info_html = f"""
+        <b>� ✨ Story Information ✨ 📚</b><br/>
+        <br/>
+        🎭 <b>Genre:</b> {story_options.get('genre', 'Fantasy').title()}<br/>
+        🎨 <b>Art Style:</b> {story_options.get('art_style', 'Cartoon').title()}<br/>
+        😊 <b>Tone:</b> {story_options.get('tone', 'Lighthearted').title()}<br/>
+        👥 <b>Target Audience:</b> {story_options.get('audience', 'All ages').title()}<br/>
+        🎪 <b>Main Characters:</b> {characters_text}<br/>
+        <br/>
+        <i>🌟 Crafted with Magic by EpicTales AI 🌟</i><br/>
+        <i>Where Stories Come to Life! ✨</i>
+        """
+        
+        story.append(Paragraph(info_html, info_style))
+        story.append(Spacer(1, 0.5*inch))
+        
+        # Add cover image with decorative frame
+        if images_data.get('Introduction'):
+            intro_image_url = images_data['Introduction']
+            if intro_image_url.startswith('/static/'):
+                intro_image_path = intro_image_url[8:]
+                full_image_path = os.path.join("static", intro_image_path)
+                if os.path.exists(full_image_path):
+                    try:
+                        story.append(Paragraph("🖼️ ✨ Cover Illustration ✨ 🖼️", brand_subtitle))
+                        story.append(Spacer(1, 0.3*inch))
+                        
+                        # Create image with decorative frame effect
+                        img = pdf_image(full_image_path, 5*inch, 3.75*inch)
+                        story.append(img)
+                        story.append(Spacer(1, 0.4*inch))
+                    except Exception as e:
+                        logger.error(f"Error adding cover image: {e}")
+        
+        # Enhanced footer for cover page
+        story.append(Spacer(1, 0.6*inch))
+        footer_style = ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=12,
+            alignment=1,
+            textColor=colors.HexColor('#8B4513'),
+            spaceAfter=15,
+            borderWidth=2,
+            borderColor=colors.HexColor('#f97316'),
+            borderPadding=10,
+            backColor=colors.HexColor('#fef3f2')
+        )
+        story.append(Paragraph("🌐 www.epictales-ai.com | Create Magical Stories with AI! 🌟", footer_style))
+        story.append(PageBreak())
+        
+        # === STORY CHAPTERS WITH COLORED PAGES ===
+        scenes = ["Introduction", "Rising Action", "Climax", "Resolution"]
+        scene_titles = {
+            "Introduction": "� Chapter 1: The Beginning",
+            "Rising Action": "⚡ Chapter 2: The Adventure Unfolds", 
+            "Climax": "🔥 Chapter 3: The Greatest Challenge",
+            "Resolution": "🌟 Chapter 4: A Happy Ending"
+        }
+        
+        scene_emojis = {
+            "Introduction": "🌅",
+            "Rising Action": "⚔️", 
+            "Climax": "💥",
+            "Resolution": "🎉"
+        }
+        
+        for i, scene in enumerate(scenes):
+            if not story_data.get(scene):
+                continue
+                
+            # Enhanced decorative chapter header
+            chapter_title = f"{scene_emojis[scene]} {scene_titles[scene]} {scene_emojis[scene]}"
+            story.append(Paragraph(chapter_title, chapter_style))
+            story.append(Spacer(1, 0.4*inch))
+            
+            # Scene image with beautiful decorative frame
+            if images_data.get(scene):
+                image_url = images_data[scene]
+                if image_url.startswith('/static/'):
+                    image_filename = image_url[8:]
+                    full_image_path = os.path.join("static", image_filename)
+                    if os.path.exists(full_image_path):
+                        try:
+                            # Add image title
+                            img_title_style = ParagraphStyle(
+                                'ImageTitle',
+                                parent=styles['Normal'],
+                                fontSize=14,
+                                alignment=1,
+                                textColor=colors.HexColor('#f97316'),
+                                fontName='Helvetica-Bold',
+                                spaceAfter=15
+                            )
+                            story.append(Paragraph(f"✨ {scene} Illustration ✨", img_title_style))
+                            
+                            # Enhanced image with frame effect
+                            story.append(Spacer(1, 0.2*inch))
+                            img = pdf_image(full_image_path, 6*inch, 4.5*inch)
+                            story.append(img)
+                            story.append(Spacer(1, 0.4*inch))
+                        except Exception as e:
+                            logger.error(f"Error adding image for {scene}: {e}")
+            
+            # Scene text with enhanced decorative formatting
+            scene_text = story_data.get(scene, "")
+            if scene_text:
+                # Enhanced first letter effect with scene-specific styling
+                if len(scene_text) > 1:
+                    first_letter = scene_text[0].upper()
+                    rest_text = scene_text[1:]
+                    scene_color = ['#f97316', '#dc2626', '#374151', '#16a34a'][i]
+                    formatted_text = f"<font size='32' color='{scene_color}'><b>{first_letter}</b></font>{rest_text}"
+                    
+                    # Scene-specific story style
+                    scene_story_style = ParagraphStyle(
+                        f'SceneStory{i}',
+                        parent=story_style,
+                        backColor=colors_scheme[list(colors_scheme.keys())[i+1]]['bg'],
+                        borderWidth=2,
+                        borderColor=colors_scheme[list(colors_scheme.keys())[i+1]]['border'],
+                        borderRadius=10
+                    )
+                    
+                    story.append(Paragraph(formatted_text, scene_story_style))
+                else:
+                    story.append(Paragraph(scene_text, story_style))
+                
+                story.append(Spacer(1, 0.5*inch))
+            
+            # Add decorative separator except for last scene
+            if i < len(scenes) - 1:
+                separator_style = ParagraphStyle(
+                    'Separator',
+                    parent=styles['Normal'],
+                    fontSize=20,
+                    alignment=1,
+                    textColor=colors.HexColor('#f97316'),
+                    spaceAfter=30,
+                    spaceBefore=30
+                )
+                story.append(Paragraph("✨ ⭐ 🌟 ⭐ ✨", separator_style))
+                story.append(PageBreak())
+        
+        # === ENHANCED BACK PAGE ===
+        story.append(PageBreak())
+        story.append(Spacer(1, 1.5*inch))
+        
+        back_page_style = ParagraphStyle(
+            'BackPage',
+            parent=styles['Normal'],
+            fontSize=16,
+            alignment=1,
+            textColor=colors.HexColor('#2c5530'),
+            spaceAfter=25,
+            borderWidth=2,
+            borderColor=colors.HexColor('#f97316'),
+            borderPadding=15,
+            backColor=colors.HexColor('#f0f9f0'),
+            borderRadius=10
+        )
+        
+        story.append(Paragraph("🎉 ✨ Thank You for Reading! ✨ 🎉", title_style))
+        story.append(Spacer(1, 0.6*inch))
+        story.append(Paragraph("🌟 This magical story was lovingly created with EpicTales AI 🌟", back_page_style))
+        story.append(Paragraph("✨ Where imagination meets artificial intelligence ✨", back_page_style))
+        story.append(Spacer(1, 0.4*inch))
+        story.append(Paragraph("🚀 Ready for your next adventure? 🚀", back_page_style))
+        story.append(Paragraph("🌐 Visit: www.epictales-ai.com 🌐", brand_subtitle))
+        story.append(Spacer(1, 0.3*inch))
+        story.append(Paragraph("📚 Create • Imagine • Inspire 📚", back_page_style))
+        
+        # Build the PDF with custom page template
+        doc.build(story, onFirstPage=add_page_border, onLaterPages=add_page_border)
+        
+        logger.info(f"✅ Enhanced decorative PDF created successfully: {story_data.get('title', 'My Story')}")
+        return output, None
+        
+    except Exception as e:
+        logger.error(f"❌ Error creating enhanced PDF: {e}")
+        return None, str(e)
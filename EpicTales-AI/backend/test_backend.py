@@ -0,0 +1,589 @@
+"""Regression tests for the EpicTales AI backend
+
+Run from anywhere with `python -m pytest test_backend.py`. The app uses
+paths relative to the backend directory, so tests run from there.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import app as epictales  # noqa: E402
+import caches  # noqa: E402
+
+
+# LRUCache
+
+def test_lru_cache_evicts_least_recently_used_within_byte_budget():
+    cache = caches.LRUCache(10, sizeof=len)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # "a" is now the most recent
+    cache.set("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    assert cache.current_bytes == 8 and cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_expires_entries_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(caches, "time", SimpleNamespace(time=lambda: now[0]))
+    cache = caches.LRUCache(100, default_ttl=60, sizeof=len)
+    cache.set("story", b"x")
+    cache.set("forever", b"y", ttl=0)
+    now[0] += 59
+    assert cache.get("story") == b"x"
+    now[0] += 2
+    assert cache.get("story") is None
+    assert cache.get("forever") == b"y"
+    assert cache.stats()["expirations"] == 1
+
+
+def test_lru_cache_oversized_value_replaces_nothing_and_drops_old_entry():
+    cache = caches.LRUCache(10, sizeof=len)
+    cache.set("key", b"old")
+    cache.set("key", b"far too large for the budget")
+    assert cache.get("key") is None
+    assert cache.current_bytes == 0
+
+
+# BoundedExecutor
+
+def test_bounded_executor_rejects_when_full():
+    executor = epictales.BoundedExecutor(1, 1, "test-full")
+    release = threading.Event()
+    executor.submit_all([(release.wait, ()), (release.wait, ())])
+    with pytest.raises(epictales.PoolBusyError):
+        executor.submit(release.wait)
+    release.set()
+
+
+def test_bounded_executor_runs_higher_priority_first():
+    executor = epictales.BoundedExecutor(1, 10, "test-priority")
+    release = threading.Event()
+    order = []
+    executor.submit(release.wait)
+    futures = [executor.submit(order.append, p, priority=p) for p in (2, 1, 2, 0, 1)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == [0, 1, 1, 2, 2]
+
+
+def test_bounded_executor_skips_cancelled_tasks():
+    executor = epictales.BoundedExecutor(1, 10, "test-cancel")
+    release = threading.Event()
+    ran = []
+    blocker = executor.submit(release.wait)
+    cancelled = executor.submit(ran.append, "cancelled")
+    kept = executor.submit(ran.append, "kept")
+    assert cancelled.cancel()
+    release.set()
+    blocker.result(timeout=5)
+    kept.result(timeout=5)
+    assert ran == ["kept"]
+    assert executor.stats()["pending"] == 0
+
+
+def test_bounded_executor_waiting_submit_holds_no_capacity():
+    """A batch waiting for room must not starve smaller submissions meanwhile"""
+    executor = epictales.BoundedExecutor(2, 1, "test-all-or-nothing")
+    release = threading.Event()
+    executor.submit_all([(release.wait, ()), (release.wait, ())])
+
+    waiting = {}
+    def submit_big():
+        waiting["futures"] = executor.submit_all([(time.sleep, (0,))] * 3, timeout=5)
+    thread = threading.Thread(target=submit_big)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        # One slot is still free - the waiting batch of three must not have taken it
+        small = executor.submit(time.sleep, 0)
+    finally:
+        release.set()
+    small.result(timeout=5)
+    thread.join(timeout=5)
+    assert len(waiting["futures"]) == 3
+
+
+def test_bounded_executor_rejects_batch_larger_than_capacity():
+    executor = epictales.BoundedExecutor(1, 1, "test-too-big")
+    with pytest.raises(epictales.PoolBusyError):
+        executor.submit_all([(time.sleep, (0,))] * 3, timeout=1)
+
+
+def test_bounded_executor_wait_for_room_wakes_when_a_task_finishes():
+    executor = epictales.BoundedExecutor(1, 1, "test-room")
+    release = threading.Event()
+    executor.submit_all([(release.wait, ()), (release.wait, ())])
+    assert not executor.wait_for_room(1, timeout=0.05)
+    threading.Timer(0.1, release.set).start()
+    started = time.time()
+    assert executor.wait_for_room(1, timeout=5)
+    assert time.time() - started < 2
+
+
+# SingleFlight
+
+def test_single_flight_runs_once_for_concurrent_callers():
+    flight = epictales.SingleFlight()
+    calls = []
+    start = threading.Barrier(8)
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+    def caller(results):
+        start.wait()
+        results.append(flight.do("key", work))
+    results = []
+    threads = [threading.Thread(target=caller, args=(results,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == ["done"] * 8
+    assert len(calls) == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_cancels_only_when_every_holder_released():
+    flight = epictales.SingleFlight()
+    executor = epictales.BoundedExecutor(1, 10, "test-flight")
+    release = threading.Event()
+    executor.submit(release.wait)
+    try:
+        future, leader = flight.join_or_lead("scene")
+        assert leader
+        flight.attach("scene", future, executor.submit(time.sleep, 0))
+        follower, follower_leads = flight.join_or_lead("scene")
+        assert follower is future and not follower_leads
+
+        flight.release("scene", future)
+        assert not future.cancelled()
+        flight.release("scene", future)
+        assert future.cancelled()
+    finally:
+        release.set()
+
+
+def test_single_flight_caller_after_last_release_leads_fresh_work():
+    flight = epictales.SingleFlight()
+    executor = epictales.BoundedExecutor(1, 10, "test-flight-fresh")
+    release = threading.Event()
+    executor.submit(release.wait)
+    try:
+        future, _ = flight.join_or_lead("scene")
+        flight.attach("scene", future, executor.submit(time.sleep, 0))
+        flight.release("scene", future)
+
+        fresh, leader = flight.join_or_lead("scene")
+        assert leader
+        assert fresh is not future and not fresh.cancelled()
+    finally:
+        release.set()
+
+
+# ModelHealth circuit breaker
+
+class FakeClock:
+    """Stands in for the time module with a clock the test moves by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(epictales, "time", clock)
+    return epictales.ModelHealth(failure_threshold=3, cooldown=60, default_latency=10), clock
+
+
+def test_breaker_opens_after_threshold_and_skips_open_circuit(breaker):
+    health, _ = breaker
+    flaky, steady = ("flaky", "http"), ("steady", "http")
+    for _ in range(2):
+        health.record_failure(flaky)
+    assert health.acquire(flaky)  # Still closed below the threshold
+    health.record_failure(flaky)
+    assert not health.acquire(flaky)
+    assert health.ordered([flaky, steady]) == [steady]
+
+
+def test_breaker_lets_one_probe_through_after_cooldown(breaker):
+    health, clock = breaker
+    key = ("model", "http")
+    for _ in range(3):
+        health.record_failure(key)
+    clock.now += 59
+    assert not health.acquire(key)
+    clock.now += 2
+    assert health.ordered([key]) == [key]
+    assert health.acquire(key)
+    assert not health.acquire(key)  # Only one probe at a time
+    health.record_success(key, 1.5)
+    assert health.acquire(key) and health.acquire(key)  # Closed again
+
+
+def test_breaker_failed_probe_reopens_circuit(breaker):
+    health, clock = breaker
+    key = ("model", "client")
+    for _ in range(3):
+        health.record_failure(key)
+    clock.now += 61
+    assert health.acquire(key)
+    health.record_failure(key)
+    assert not health.acquire(key)
+    assert health.ordered([key]) == []
+    clock.now += 61
+    assert health.acquire(key)
+
+
+def test_breaker_release_returns_unused_probe_slot(breaker):
+    """An attempt skipped because upstream was busy must not hold the probe forever"""
+    health, clock = breaker
+    key = ("model", "http")
+    for _ in range(3):
+        health.record_failure(key)
+    clock.now += 61
+    assert health.acquire(key)
+    health.release(key)
+    assert health.acquire(key)
+
+
+# Derivative negotiation
+
+@pytest.fixture
+def static_image():
+    name = f"test_negotiation_{os.getpid()}.png"
+    path = os.path.join("static", name)
+    os.makedirs("static", exist_ok=True)
+    Image.new("RGB", (64, 48), "red").save(path)
+    yield name
+    os.remove(path)
+    for derived in os.listdir(epictales.DERIVATIVE_DIR):
+        if derived.startswith(name):
+            os.remove(os.path.join(epictales.DERIVATIVE_DIR, derived))
+
+
+@pytest.mark.parametrize("accept", [
+    "*/*",
+    "image/*,*/*;q=0.8",  # Older Safari
+    "image/png,image/svg+xml,image/*;q=0.8,video/*;q=0.8,*/*;q=0.5",
+])
+def test_static_image_wildcard_accept_serves_original(static_image, accept):
+    response = epictales.app.test_client().get(f"/static/{static_image}", headers={"Accept": accept})
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert "Accept" in response.headers["Vary"]
+
+
+def test_static_image_explicit_webp_accept_serves_webp(static_image):
+    accept = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+    response = epictales.app.test_client().get(f"/static/{static_image}", headers={"Accept": accept})
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+
+
+def test_static_image_fmt_parameter_overrides_accept(static_image):
+    client = epictales.app.test_client()
+    response = client.get(f"/static/{static_image}?fmt=jpeg", headers={"Accept": "image/webp"})
+    assert response.mimetype == "image/jpeg"
+    response = client.get(f"/static/{static_image}?fmt=original", headers={"Accept": "image/webp"})
+    assert response.mimetype == "image/png"
+
+
+# Story templates
+
+STORY_OPTIONS = [
+    ("dragon", "fantasy", "lighthearted", "children", ["Samantha", "Leo"]),
+    ("space pirates", "sci-fi", "adventurous", "teens", []),
+    ("lost puppy", "mystery", "magical", "preschool", ["Alex", "Maya", "Sam"]),
+    ("robot garden", "adventure", "educational", "all ages", ["Nia"]),
+]
+
+
+def test_build_story_is_identical_across_hash_seeds():
+    """Workers get different PYTHONHASHSEEDs - the same options must still give the same story"""
+    script = (
+        "import json, app; "
+        f"print(json.dumps([app.build_story(*options) for options in {STORY_OPTIONS!r}]))"
+    )
+    outputs = []
+    for seed in ("1", "4242"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=BACKEND_DIR, env=env,
+            capture_output=True, text=True, timeout=60, check=True
+        )
+        outputs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    assert outputs[0] == outputs[1]
+
+
+def test_build_story_keeps_character_names_containing_slot_words():
+    """Slot words like "Sam" inside an inserted name must not be filled in again"""
+    story = epictales.build_story("dragon", "fantasy", "lighthearted", "children", ["Samantha", "Leo"])
+    names = re.findall(r"Sam\w*", " ".join(story[scene] for scene in epictales.SCENES))
+    assert names and set(names) == {"Samantha"}
+
+
+# Fallback images
+
+@pytest.mark.parametrize("error", [
+    epictales.PoolBusyError("full"), TimeoutError("slow"), BrokenProcessPool("died")
+])
+def test_fallback_image_drawn_inline_when_render_pool_fails(monkeypatch, error):
+    def failing_run(fn, *args, timeout=None):
+        raise error
+    monkeypatch.setattr(epictales.render_pool, "run", failing_run)
+    filename = epictales.create_beautiful_fallback("Climax", f"render pool test {error!r}", "anime")
+    assert filename is not None
+    path = os.path.join("static", filename)
+    try:
+        assert os.path.getsize(path) > 0
+    finally:
+        os.remove(path)
+
+
+# /generate/batch stream
+
+@pytest.fixture
+def fake_images(monkeypatch):
+    """Scene images that resolve instantly without calling Hugging Face"""
+    calls = []
+    def fake_generate(prompt, scene_name, art_style="cartoon"):
+        calls.append((prompt, scene_name))
+        time.sleep(0.05)
+        return f"fake_{scene_name.lower().replace(' ', '_')}.png"
+    monkeypatch.setattr(epictales, "generate_image_with_fallback", fake_generate)
+    epictales.story_cache.clear()
+    return calls
+
+
+def read_batch(specs, timeout=10):
+    """POST a batch and return its NDJSON lines, failing instead of hanging"""
+    result = {}
+    def run():
+        response = epictales.app.test_client().post("/generate/batch", json={"stories": specs})
+        result["status"] = response.status_code
+        result["lines"] = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "batch stream did not finish"
+    return result
+
+
+def test_batch_stream_specs_sharing_scene_images_all_complete(fake_images):
+    """Specs that differ only in tone build the same image prompts and share scene futures"""
+    result = read_batch([
+        {"story_idea": "dragon", "tone": "lighthearted"},
+        {"story_idea": "dragon", "tone": "magical"},
+    ])
+    assert result["status"] == 200
+    *stories, summary = result["lines"]
+    assert sorted(line["index"] for line in stories) == [0, 1]
+    assert all(line["success"] for line in stories)
+    assert summary["complete"] and summary["unique"] == 2 and summary["failed"] == 0
+    assert len(fake_images) == len(epictales.SCENES)  # Shared scenes are generated once
+
+
+def test_batch_stream_reports_bad_specs_and_duplicates(fake_images):
+    result = read_batch([{"story_idea": "castle"}, "not an object", {"story_idea": "castle"}])
+    *stories, summary = result["lines"]
+    assert stories[0] == {"index": 1, "success": False, "error": "Story spec must be an object"}
+    assert sorted(line["index"] for line in stories[1:]) == [0, 2]
+    assert stories[1]["story"] == stories[2]["story"]
+    assert summary == dict(summary, complete=True, stories=3, unique=1, failed=1)
+
+
+def test_batch_stream_ends_at_time_limit(monkeypatch):
+    """Unfinished stories are reported as failed before a sync worker would be killed"""
+    release = threading.Event()
+    def slow_generate(prompt, scene_name, art_style="cartoon"):
+        release.wait(5)
+        return None
+    monkeypatch.setattr(epictales, "generate_image_with_fallback", slow_generate)
+    monkeypatch.setattr(epictales, "BATCH_GENERATE_TIMEOUT", 0.3)
+    monkeypatch.setattr(epictales, "BATCH_GENERATE_WINDOW", 1)
+    try:
+        started = time.time()
+        result = read_batch([{"story_idea": "slow comet"}, {"story_idea": "slow meteor"}])
+        assert time.time() - started < 3
+    finally:
+        release.set()
+    *stories, summary = result["lines"]
+    assert sorted(line["index"] for line in stories) == [0, 1]
+    assert not any(line["success"] for line in stories)
+    assert "time limit" in stories[0]["error"]
+    assert summary["complete"] and summary["failed"] == 2
+
+
+def test_batch_rejects_empty_list():
+    response = epictales.app.test_client().post("/generate/batch", json={"stories": []})
+    assert response.status_code == 400
+
+
+# Local text model backend
+
+def test_text_backend_import_does_not_load_model():
+    import app_perfect_combination as text_app
+    assert not text_app.PRELOAD_TEXT_MODEL  # Only preloads under gunicorn
+    assert text_app.text_model_state["status"] == "not_loaded"
+
+
+def test_text_backend_ready_names_missing_packages(monkeypatch):
+    import app_perfect_combination as text_app
+    monkeypatch.setattr(text_app, "TEXT_MODEL_PACKAGES", ("json", "epictales_missing_package"))
+    response = text_app.app.test_client().get("/ready")
+    assert response.status_code == 503
+    assert response.get_json()["error"] == (
+        "epictales_missing_package not installed - run: pip install epictales_missing_package"
+    )
+
+
+def fake_text_pipeline(prompts, **kwargs):
+    return [[{"generated_text": prompt + " and then"}] for prompt in prompts]
+
+
+@pytest.mark.parametrize("error, stays_enabled", [(RuntimeError, True), (TypeError, False), (ValueError, False)])
+def test_text_batch_prefix_cache_failure_falls_back(monkeypatch, error, stays_enabled):
+    """Only an API mismatch turns the prefix cache off, other errors fall back for one batch"""
+    import app_perfect_combination as text_app
+    def failing_generate(pipe, items, **options):
+        raise error("boom")
+    monkeypatch.setattr(text_app, "initialize_text_model", lambda: fake_text_pipeline)
+    monkeypatch.setattr(text_app, "prefix_cache_supported", lambda: True)
+    monkeypatch.setattr(text_app, "prefix_cache_enabled", True)
+    monkeypatch.setattr(text_app, "generate_with_prefix_cache", failing_generate)
+    assert text_app.run_text_batch([("Story concept:", " a fox. Climax: ")]) == ["and then"]
+    assert text_app.prefix_cache_enabled is stays_enabled
+
+
+def test_prefix_past_stays_legacy_tuple_for_models_without_cache_classes():
+    """GPT-2 on transformers 4.x rejects a DynamicCache, so the tuple must go through as is"""
+    import app_perfect_combination as text_app
+    legacy = (("key", "value"),)
+    assert text_app.prefix_past_for_model(SimpleNamespace(_supports_cache_class=False), legacy) is legacy
+
+
+class ByteTokenizer:
+    """Byte-level stand-in for the GPT-2 tokenizer: one token per UTF-8 byte, 256 is EOS"""
+
+    eos_token_id = 256
+
+    def __init__(self):
+        self.pad_token_id = self.eos_token_id
+
+    def __call__(self, text, return_tensors=None):
+        input_ids = list(text.encode("utf-8"))
+        if return_tensors == "pt":
+            import torch
+            input_ids = torch.tensor([input_ids])
+        return {"input_ids": input_ids}
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return bytes(int(i) for i in token_ids if int(i) < 256).decode("utf-8", errors="replace")
+
+    def batch_decode(self, rows, skip_special_tokens=False):
+        return [self.decode(row, skip_special_tokens) for row in rows]
+
+
+def build_tiny_gpt2():
+    """Small random GPT-2 built locally, skipped only when torch/transformers are missing"""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(
+        vocab_size=257, n_positions=256, n_embd=32, n_layer=2, n_head=2,
+        bos_token_id=256, eos_token_id=256,
+        initializer_range=0.5  # Spread the logits so greedy picks have no near-ties
+    )
+    model = transformers.GPT2LMHeadModel(config)
+    model.eval()
+    return ByteTokenizer(), model
+
+
+def test_prefix_cache_matches_uncached_greedy_generation(monkeypatch):
+    import app_perfect_combination as text_app
+    tokenizer, model = build_tiny_gpt2()
+    import torch
+    if not text_app.prefix_cache_supported():
+        pytest.skip("prefix cache needs transformers>=4.38")
+    monkeypatch.setattr(text_app, "prefix_cache", text_app.PrefixKVCache(16 * 1024 * 1024))
+    pipe = SimpleNamespace(tokenizer=tokenizer, model=model)
+    greedy = {"max_new_tokens": 8, "do_sample": False, "temperature": None}
+    # Ragged on both sides, plus a row with no cached prefix at all
+    items = [
+        ("Once upon a time, in a kingdom by the sea, there lived a wise old owl. Story concept:", " dragon. Introduction: "),
+        ("Story concept:", " a brave little knight who wanted to learn to fly. Climax: "),
+        ("", "The end of the"),
+    ]
+
+    expected = []
+    for prefix, suffix in items:
+        input_ids = torch.tensor([tokenizer(prefix + suffix)["input_ids"]])
+        with torch.no_grad():
+            output = model.generate(
+                input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                pad_token_id=tokenizer.pad_token_id, **greedy
+            )
+        expected.append(tokenizer.decode(output[0, input_ids.shape[1]:], skip_special_tokens=True).strip())
+
+    assert text_app.generate_with_prefix_cache(pipe, items, **greedy) == expected
+    assert text_app.prefix_cache.stats()["misses"] == 2
+    assert text_app.generate_with_prefix_cache(pipe, items, **greedy) == expected  # Served from the cache
+    assert text_app.prefix_cache.stats()["hits"] == 2
+
+
+def test_conv1d_to_linear_keeps_model_output():
+    import app_perfect_combination as text_app
+    tokenizer, model = build_tiny_gpt2()
+    import copy
+    import torch
+    converted_model = copy.deepcopy(model)
+    converted = text_app.convert_conv1d_to_linear(converted_model)
+    assert converted and all(
+        isinstance(converted_model.get_submodule(name), torch.nn.Linear) for name in converted
+    )
+    input_ids = tokenizer(text_app.QUANT_CHECK_TEXTS[0], return_tensors="pt")["input_ids"]
+    with torch.no_grad():
+        torch.testing.assert_close(converted_model(input_ids).logits, model(input_ids).logits)
+
+
+@pytest.mark.parametrize("min_agreement, accepted", [(0.0, True), (1.01, False)])
+def test_quantize_text_model_agreement_gate(monkeypatch, min_agreement, accepted):
+    import app_perfect_combination as text_app
+    tokenizer, model = build_tiny_gpt2()
+    import torch
+    monkeypatch.setattr(text_app, "TEXT_QUANT_MIN_AGREEMENT", min_agreement)
+    monkeypatch.setitem(text_app.text_model_state, "quantization_agreement", None)
+    quantized = text_app.quantize_text_model(model, tokenizer)
+
+    agreement = text_app.text_model_state["quantization_agreement"]
+    assert 0.0 <= agreement <= 1.0
+    assert (quantized is not None) is accepted
+    if accepted:
+        assert any(isinstance(m, torch.ao.nn.quantized.dynamic.Linear) for m in quantized.modules())
+        assert quantized is not model